@@ -3,188 +3,857 @@ import cv2
 import contextlib
 import numpy as np
 import json
-import math
+import os
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import threading
+import multiprocessing
+from multiprocessing import shared_memory
 import time
-from collections import defaultdict, deque
+import uuid
+from collections import OrderedDict, defaultdict, deque
 from statistics import mode
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse, JSONResponse
-import io
 import base64
 from PIL import Image
 
+# Optional: only needed for msgpack answers from /leds
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Global variables
-config_data = {}
-led_color_samples = defaultdict(lambda: deque(maxlen=30))  # Store last 30 samples for each LED (~1-2 seconds)
-current_frames = {"Camera 1": None, "Camera 2": None}
-combined_frame = None
+config_data = {}  # All configured LEDs across cameras: {led_id: [x, y]}
+stream_led_maps = {}  # LEDs visible to each camera: {stream_name: {led_id: [x, y]}}
+led_indexes = {}  # Spatial index per camera, rebuilt by load_config()
+led_samples = None  # Color sample history of every LED (LEDSampleHistory), rebuilt by load_config()
+current_frames = {"Camera 1": None, "Camera 2": None}  # Latest frame view per camera, see make_frame_view()
+combined_frame = None  # Frame view of both cameras side by side
 camera_running = False
 camera_thread = None
+preview_thread = None
+headless = False  # No HighGUI window at all (--headless)
+preview_fps = 5.0  # Refresh rate of the preview window (--preview-fps)
+camera_frame_rates = {}  # Per camera: measured capture/processed fps and dropped frames
+use_camera_processes = False  # Run one detection process per camera (--processes)
+led_ids = []  # Config order of config_data, shared by all processes
+led_id_table = {}  # {led_id: position in led_ids}
+led_groups = {}  # LED groups: {name: positions in led_ids}, see compile_led_groups()
+group_checks = {}  # Check cache: {group: (snapshot generation, per-color check lists)}
+led_patterns = {}  # Expected LED states per test step: {step: LEDPattern}, see compile_led_patterns()
+led_snapshot = None  # Latest LEDSnapshot, replaced (never modified) by publish_led_snapshot()
+snapshot_lock = threading.Lock()
+# Generations start at the boot time in microseconds, so ETags and ?since= values kept
+# from an earlier run of the server are always older than any generation of this one
+frame_generations = itertools.count(time.time_ns() // 1000)  # Stamps every frame view; clients compare them via ETag or ?since=
+snapshot_generations = itertools.count(time.time_ns() // 1000)  # Stamps every LED snapshot whose content changed
+server_instance = uuid.uuid4().hex[:8]  # Tells this run of the server apart from earlier ones, e.g. on /ws/leds resume
+status_generations = itertools.count(time.time_ns() // 1000)  # Stamps every change of what /status reports
+status_stamp = (None, 0)  # (camera state and LED snapshot generation, status generation) last seen by /status
+led_change_journal = deque(maxlen=256)  # (generation, {led_id: led_state_entry()}) for LEDs whose state changed
+led_journal_floor = 0  # Changes after this generation are all in led_change_journal
+armed_session = None  # Sample window opened by POST /arm: {"session_id", "color", "group", "armed_at"}
+arm_sessions = itertools.count(1)
+jpeg_cache = OrderedDict()  # Encode cache: {(generation, scale, quality): Future of JPEG bytes}, oldest first
+encode_executor = None  # Worker pool for JPEG encoding, started by lifespan()
+detection_engines = {"Camera 1": "hough", "Camera 2": "hough"}  # Per camera: "hough" or "stencil"
+color_lut = None  # Quantized BGR -> color code table, see load_color_lut()
+led_stencils = {}  # Stencil engine cache: {(stream_name, frame size): LEDStencils}
+hough_search_tiles = {}  # Hough engine cache: {(stream_name, frame size): [(x0, y0, x1, y1), ...]}
+label_layers = {}  # Overlay cache: {(layout, image size): label owner map}, see get_label_layer()
+crop_transforms = {}  # Geometry cache: {(stream_name, source size): (matrix, crop size)}
+detection_workspaces = {}  # Hough engine buffers: {(stream_name, frame size): DetectionWorkspace}
+
+STREAM_NAMES = ("Camera 1", "Camera 2")
+
+# Each camera's view is the source frame resized to CAMERA_RESIZE (width, height), rotated
+# 180 degrees and cropped to CAMERA_CROPS (y0, y1, x0, x1); LED coordinates are crop pixels
+CAMERA_RESIZE = (1706, 960)
+CAMERA_CROPS = {
+    "Camera 1": (250, 820, 340, 1451),
+    "Camera 2": (120, 820, 500, 1502)
+}
+CAMERA_FRAME_SHAPES = {name: (y1 - y0, x1 - x0, 3) for name, (y0, y1, x0, x1) in CAMERA_CROPS.items()}
+
+# Shared memory used by --processes
+FPS_WINDOW_SECONDS = 2.0  # Window for the measured frame rates reported by /status
+FRAME_RING_SLOTS = 4  # Frames kept per camera; the supervisor copies each frame it publishes
+SAMPLE_RING_CAPACITY = 8192  # Detection records kept per camera (~4 s with every LED lit)
+DETECTION_DTYPE = np.dtype([
+    ("frame", "<i8"),
+    ("led", "<i4"),
+    ("color", "u1"),
+    ("radius", "u1"),
+    ("x", "<u2"),
+    ("y", "<u2"),
+    ("timestamp", "<f8")
+])
+LED_MATCH_RADIUS = 10  # Max distance (px) between a circle centre and a configured LED position
+DETECTION_ENGINES = ("hough", "stencil")
+BINARY_THRESHOLD = 30  # Gray level above which a pixel counts as lit
+CAMERA1_DIM_FACTOR = 1.7  # Brightness divisor for the over-exposed bottom-left of Camera 1
+DIM_LUT = np.floor(np.arange(256) / CAMERA1_DIM_FACTOR).astype(np.uint8)
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+HOUGH_MAX_RADIUS = 10  # Largest LED radius (px) searched by HoughCircles
+HOUGH_SEARCH_MARGIN = 8  # Extra px searched around each LED's match area (None = search the whole frame)
+STENCIL_RADIUS = 4  # Radius (px) of the disc sampled around each configured LED
+STENCIL_ON_FRACTION = 0.5  # Share of lit stencil pixels needed to call an LED on
+
+COLOR_NAMES = ('red', 'green', 'blue', 'orange')
+NO_COLOR = len(COLOR_NAMES)  # Color code for pixels matching none of the ranges
+COLOR_CODES = {name: code for code, name in enumerate(COLOR_NAMES)}
+SYSTEM_LEDS = ('pwr', 'alm', 'fan')  # Members of the built-in "system" LED group
+
+# Fields of the bulk /leds query and their types in its packed binary answer
+LED_QUERY_FIELDS = {
+    "color": "u1",  # Color code, index into COLOR_NAMES; NO_COLOR without a color
+    "count": "<u2",
+    "confidence": "<f4",
+    "last_seen": "<f8"  # Time of the newest sample, NaN if none
+}
+
+# Expected LED states per test step, {step: {selector: state}}; data.json "patterns" adds or
+# replaces steps. A selector is an LED group, an LED ID or an ID prefix ending in *, and a
+# state is a color, "off" or "any" (don't care). Later entries override earlier ones, and
+# LEDs no selector mentions are don't-care.
+# The green step of set_led_color turns pts.sh LED 23 off. The pts index-to-ID mapping is not
+# recorded anywhere; since index 0 addresses all LEDs, index 23 is taken to be the 23rd LED of
+# data.json (pon23). Override the step in data.json if the board maps it differently.
+DEFAULT_LED_PATTERNS = {
+    "red": {"all": "red"},
+    "green": {"all": "green", "pon23": "off"},
+    "blue": {"eth": "blue"}
+}
+
+# An LED's reported color is the mode of its recent samples, if enough of them agree
+SAMPLE_HISTORY = 30  # Samples kept per LED (~1-2 seconds)
+MODE_WINDOW_SECONDS = 5.0  # Only samples this recent take part in the mode
+MODE_MIN_SAMPLES = 5  # Fewer recent samples than this means no data
+MODE_CONFIDENCE = 0.6  # Share of recent samples the mode needs
+JPEG_CACHE_SIZE = 32  # Encoded frame variants kept for repeat requests
+JPEG_QUALITY = 95  # cv2.imencode's default quality
+MJPEG_FPS = 10.0  # Default per-client frame rate of the /stream endpoints
+MJPEG_MAX_FPS = 30.0
+MJPEG_BOUNDARY = "frame"
+MJPEG_SHUTDOWN_GRACE = 2  # Seconds uvicorn waits for open streams before closing them
+ENCODE_WORKERS = 2  # Threads encoding JPEGs, so requests never encode on the event loop
+# A board-wide color change restarts the sample windows, so modes follow the new state at once
+TRANSITION_STREAK = 3  # Samples in a row an LED needs in a color other than its mode to count as flipped
+TRANSITION_FRACTION = 0.5  # Share of LEDs with a mode that must flip together
+TRANSITION_MIN_LEDS = 3
+VERDICT_STREAK = 5  # Consecutive agreeing samples /await_verdict wants from each LED by default
+VERDICT_MAX_AGE = 1.0  # An LED whose newest sample is older than this counts as not seen
+VERDICT_MAX_TIMEOUT = 60.0
+VERDICT_POLL_INTERVAL = 0.05
+WS_POLL_INTERVAL = 0.02  # How often /ws/leds looks for a new snapshot (under one frame)
+SNAPSHOT_MAX_AGE = 0.5  # Seconds before a request rebuilds the LED snapshot itself (e.g. cameras stopped)
+
+# HSV ranges (OpenCV scale, H 0-180) for each color; orange needs S and V >= 150
+COLOR_THRESHOLDS = {
+    'red': [([0, 120, 70], [10, 255, 255]), ([170, 120, 70], [180, 255, 255])],
+    'green': [([35, 100, 100], [85, 255, 255])],
+    'blue': [([100, 100, 100], [130, 255, 255])],
+    'orange': [([11, 150, 150], [25, 255, 255])]
+}
+LABEL_OFFSET_X = 12  # Static LED labels are drawn this far right of the configured position
+COLOR_LUT_BITS = 6  # Bits kept per BGR channel in the color lookup table (64^3 entries)
+COLOR_LUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lut_cache")
+
+# BGR colors for drawing
+COLOR_BGR = {
+    'red': (0, 0, 255),
+    'green': (0, 255, 0),
+    'blue': (255, 0, 0),
+    'orange': (0, 165, 255)
+}
 
 # Enhanced best image tracking (last 5 seconds with quality assessment)
 best_image_data = {
-    "image": None,
+    "view": None,
     "led_count": 0,
     "timestamp": 0,
     "quality_score": 0,
     "recent_images": deque(maxlen=150)  # Store ~5 seconds of images at 30fps
 }
 
+class LEDIndex:
+    """Uniform grid over configured LED positions for nearest-LED lookups.
+
+    Cells are one match radius wide and every LED is registered in the 3x3 block
+    of cells around its own, so a lookup only has to check the candidates stored
+    in the single cell the query point falls into.
+    """
+
+    def __init__(self, led_map, radius=LED_MATCH_RADIUS):
+        self.radius = radius
+        self.ids = [key for key, value in led_map.items() if isinstance(value, list) and len(value) == 2]
+        self.points = np.array([led_map[key] for key in self.ids], dtype=np.float64).reshape(-1, 2)
+
+        if not self.ids:
+            self.origin = np.zeros(2)
+            self.candidates = np.full((1, 1, 1), -1, dtype=np.int32)
+            return
+
+        self.origin = self.points.min(axis=0) - radius
+        grid_w, grid_h = (np.floor((self.points.max(axis=0) + radius - self.origin) / radius).astype(int) + 1)
+
+        cells = defaultdict(list)
+        led_cells = np.floor((self.points - self.origin) / radius).astype(int)
+        for index, (cell_x, cell_y) in enumerate(led_cells):
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    cells[(cell_y + dy, cell_x + dx)].append(index)
+
+        # Candidates stay in config order so ties resolve like the old linear scan
+        depth = max(len(indices) for indices in cells.values())
+        self.candidates = np.full((grid_h, grid_w, depth), -1, dtype=np.int32)
+        for (cell_y, cell_x), indices in cells.items():
+            if 0 <= cell_y < grid_h and 0 <= cell_x < grid_w:
+                self.candidates[cell_y, cell_x, :len(indices)] = indices
+
+    def lookup_batch(self, centers):
+        """Return the index of the nearest LED for every (x, y) centre, or -1 when none is in range"""
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        matches = np.full(len(centers), -1, dtype=np.int32)
+        if len(centers) == 0 or not self.ids:
+            return matches
+
+        grid_h, grid_w = self.candidates.shape[:2]
+        cells = np.floor((centers - self.origin) / self.radius).astype(np.int64)
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < grid_w) & (cells[:, 1] >= 0) & (cells[:, 1] < grid_h)
+        if not inside.any():
+            return matches
+
+        candidates = self.candidates[cells[inside, 1], cells[inside, 0]]
+        offsets = self.points[candidates] - centers[inside, None, :]
+        dist_sq = (offsets ** 2).sum(axis=2)
+        dist_sq[(candidates < 0) | (dist_sq > self.radius ** 2)] = np.inf
+
+        rows = np.arange(len(candidates))
+        best = dist_sq.argmin(axis=1)
+        matches[inside] = np.where(np.isfinite(dist_sq[rows, best]), candidates[rows, best], -1)
+        return matches
+
+    def lookup(self, center):
+        """Return the LED ID nearest to a single centre, or None when none is in range"""
+        match = self.lookup_batch([center])[0]
+        return self.ids[match] if match >= 0 else None
+
+    def ids_for(self, matches):
+        """Translate lookup_batch() indices to LED IDs (None for unmatched)"""
+        return [self.ids[match] if match >= 0 else None for match in matches]
+
+def parse_led_maps(raw_config):
+    """Split a data.json document into per-camera LED maps.
+
+    Two layouts are accepted:
+      - per camera: {"Camera 1": {"pon1": [x, y], ...}, "Camera 2": {...}}
+      - flat (legacy): {"pon1": [x, y], ...}, which applies to every camera
+    """
+    def led_entries(section):
+        return {key: value for key, value in section.items() if isinstance(value, list) and len(value) == 2}
+
+    if any(isinstance(raw_config.get(name), dict) for name in STREAM_NAMES):
+        return {name: led_entries(raw_config.get(name) or {}) for name in STREAM_NAMES}
+
+    flat_map = led_entries(raw_config)
+    return {name: flat_map for name in STREAM_NAMES}
+
+def compile_led_groups(raw_config, led_ids):
+    """Resolve the LED groups to arrays of positions in led_ids.
+
+    Built in: "all", "pon" and "eth" (by ID prefix) and "system" (SYSTEM_LEDS). A "groups"
+    section in data.json adds or overrides groups: {"name": ["pon1", "eth*", ...]}, where
+    an entry ending in * matches every LED ID with that prefix.
+    """
+    patterns = {
+        "all": ["*"],
+        "pon": ["pon*"],
+        "eth": ["eth*"],
+        "system": list(SYSTEM_LEDS)
+    }
+    custom = raw_config.get("groups")
+    custom = {name: members for name, members in custom.items() if isinstance(members, list)} if isinstance(custom, dict) else {}
+    patterns.update(custom)
+
+    groups = {}
+    for name, members in patterns.items():
+        selected = set()
+        for member in members:
+            if isinstance(member, str) and member.endswith("*"):
+                selected.update(led_id for led_id in led_ids if led_id.startswith(member[:-1]))
+            elif member in led_ids:
+                selected.add(member)
+            elif name in custom:
+                print(f"LED group {name}: unknown LED {member}")
+        groups[name] = np.array(sorted(led_ids.index(led_id) for led_id in selected), dtype=np.int64)
+    return groups
+
+class LEDPattern(NamedTuple):
+    """A test step's expected LED states as bitmasks over positions in led_ids"""
+    color_masks: Dict[str, int]  # LEDs that must show each color
+    off_mask: int  # LEDs that must show no color
+
+def positions_to_mask(positions, size):
+    """Bitmask with bit i set for every position i"""
+    bits = np.zeros(size, dtype=bool)
+    bits[positions] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+def mask_to_positions(mask):
+    positions = []
+    while mask:
+        lowest = mask & -mask
+        positions.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return positions
+
+def compile_led_patterns(raw_config, led_ids, groups):
+    """Compile DEFAULT_LED_PATTERNS and the data.json "patterns" section to LEDPatterns"""
+    specs = dict(DEFAULT_LED_PATTERNS)
+    custom = raw_config.get("patterns")
+    if isinstance(custom, dict):
+        specs.update({step: spec for step, spec in custom.items() if isinstance(spec, dict)})
+
+    patterns = {}
+    for step, spec in specs.items():
+        states = {}  # {position: color or "off"}
+        for selector, state in spec.items():
+            if selector in groups:
+                positions = groups[selector].tolist()
+            elif selector in led_ids:
+                positions = [led_ids.index(selector)]
+            elif selector.endswith("*"):
+                positions = [position for position, led_id in enumerate(led_ids) if led_id.startswith(selector[:-1])]
+            else:
+                print(f"LED pattern {step}: unknown LED or group {selector}")
+                continue
+            if state not in COLOR_CODES and state not in ("off", "any"):
+                print(f"LED pattern {step}: unknown state {state} for {selector}")
+                continue
+
+            for position in positions:
+                if state == "any":
+                    states.pop(position, None)
+                else:
+                    states[position] = state
+
+        patterns[step] = LEDPattern(
+            color_masks={
+                color: positions_to_mask([position for position, state in states.items() if state == color], len(led_ids))
+                for color in COLOR_NAMES
+            },
+            off_mask=positions_to_mask([position for position, state in states.items() if state == "off"], len(led_ids))
+        )
+    return patterns
+
 # Load configuration
 def load_config():
-    global config_data
+    global config_data, stream_led_maps, led_indexes, led_ids, led_id_table, led_samples, led_groups, led_snapshot
+    global led_patterns
     try:
         with open("data.json", 'r') as file:
-            config_data = json.load(file)
-        print(f"Loaded configuration for {len(config_data)} LEDs")
+            raw_config = json.load(file)
     except Exception as e:
         print(f"Error loading config: {e}")
-        config_data = {}
+        raw_config = {}
+
+    stream_led_maps = parse_led_maps(raw_config)
+    config_data = {}
+    for led_map in stream_led_maps.values():
+        for led_id, coordinates in led_map.items():
+            config_data.setdefault(led_id, coordinates)
+    led_ids = list(config_data)
+    led_id_table = {led_id: position for position, led_id in enumerate(led_ids)}
+    led_indexes = {name: LEDIndex(led_map) for name, led_map in stream_led_maps.items()}
+    led_samples = LEDSampleHistory(len(led_ids))
+    led_groups = compile_led_groups(raw_config, led_ids)
+    led_patterns = compile_led_patterns(raw_config, led_ids, led_groups)
+    group_checks.clear()
+    led_snapshot = None
+    led_stencils.clear()
+    hough_search_tiles.clear()
+    detection_workspaces.clear()
+    label_layers.clear()
+
+    global color_lut
+    if color_lut is None:
+        color_lut = load_color_lut()
+
+    per_camera = ", ".join(f"{name}: {len(led_map)}" for name, led_map in stream_led_maps.items())
+    print(f"Loaded configuration for {len(config_data)} LEDs ({per_camera})")
 
 def getLEDID(center, stream_name):
-    global config_data
-    min_dist = float('inf')
-    ID = None
-
-    for key, value in config_data.items():
-        if isinstance(value, list) and len(value) == 2:
-            dist = math.sqrt((center[0] - value[0]) ** 2 + (center[1] - value[1]) ** 2)
-            if dist < min_dist:
-                if dist > 10:
-                    continue
-                min_dist = dist
-                ID = key
+    index = led_indexes.get(stream_name)
+    if index is None:
+        return None
+    return index.lookup(center)
+
+def getLEDIDs(centers, stream_name):
+    """Resolve the LED IDs for all circle centres of a frame in one call, searching only that camera's LEDs"""
+    index = led_indexes.get(stream_name)
+    if index is None:
+        return [None] * len(centers)
+    return index.ids_for(index.lookup_batch(centers))
 
-    return ID
+def build_color_lut(thresholds=None, bits=COLOR_LUT_BITS):
+    """Classify every quantized BGR value once with the HSV rules; returns a flat uint8 table of color codes"""
+    thresholds = thresholds or COLOR_THRESHOLDS
+    levels = 1 << bits
+    step = 256 >> bits
+
+    # Sample each quantization bin at its centre
+    values = (np.arange(levels) * step + step // 2).astype(np.uint8)
+    b, g, r = np.meshgrid(values, values, values, indexing='ij')
+    bgr = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3)
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+
+    lut = np.full(len(bgr), NO_COLOR, dtype=np.uint8)
+    for code, name in enumerate(COLOR_NAMES):
+        mask = np.zeros(len(bgr), dtype=bool)
+        for lower, upper in thresholds[name]:
+            mask |= cv2.inRange(hsv, np.array(lower), np.array(upper)).ravel() > 0
+        lut[mask & (lut == NO_COLOR)] = code
+    return lut
+
+def load_color_lut(thresholds=None, bits=COLOR_LUT_BITS):
+    """Load the color LUT from the disk cache, rebuilding it when the thresholds (or OpenCV) changed"""
+    thresholds = thresholds or COLOR_THRESHOLDS
+    key_source = json.dumps({
+        "thresholds": {name: thresholds[name] for name in COLOR_NAMES},
+        "bits": bits,
+        "opencv": cv2.__version__
+    }, sort_keys=True)
+    key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+    path = os.path.join(COLOR_LUT_DIR, f"color_lut_{key}.npy")
+
+    try:
+        lut = np.load(path)
+        if lut.shape == (1 << (3 * bits),) and lut.dtype == np.uint8:
+            return lut
+    except (OSError, ValueError):
+        pass
+
+    lut = build_color_lut(thresholds, bits)
+    try:
+        os.makedirs(COLOR_LUT_DIR, exist_ok=True)
+        np.save(path, lut)
+        print(f"Built color lookup table {path}")
+    except OSError as e:
+        print(f"Could not cache color lookup table: {e}")
+    return lut
+
+def color_codes(pixels):
+    """Map BGR pixels (any leading shape) to color codes via the LUT"""
+    global color_lut
+    if color_lut is None:
+        color_lut = load_color_lut()
+
+    shift = 8 - COLOR_LUT_BITS
+    quantized = pixels >> shift
+    index = (quantized[..., 0].astype(np.int32) << (2 * COLOR_LUT_BITS)) \
+        | (quantized[..., 1].astype(np.int32) << COLOR_LUT_BITS) \
+        | quantized[..., 2]
+    return color_lut[index]
+
+def count_color_codes(codes):
+    """Count each color code per row of a (rows, ...) code array; returns (rows, NO_COLOR + 1)"""
+    rows = len(codes)
+    bins = NO_COLOR + 1
+    flat = codes.reshape(rows, -1).astype(np.int64) + np.arange(rows)[:, None] * bins
+    return np.bincount(flat.ravel(), minlength=rows * bins).reshape(rows, bins)
+
+def classify_led_colors(image, circles):
+    """Classify the ROI around every (x, y, radius) circle of a frame in one pass.
+
+    Each ROI is the same radius-sized square detect_led_color() has always used;
+    all of them are gathered into one (N, size, size) block, classified with the
+    LUT and reduced with a single bincount. Returns the dominant color name per
+    circle and an (N, len(COLOR_NAMES)) array of color percentages.
+    """
+    circles = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    if len(circles) == 0:
+        return [], np.zeros((0, NO_COLOR))
+
+    height, width = image.shape[:2]
+    x, y, half_size = circles[:, 0], circles[:, 1], circles[:, 2]
+
+    # Rows/columns of each ROI, padded to the largest ROI and clipped to the image
+    offsets = np.arange(max(2 * int(half_size.max()), 1))
+    ys = (y - half_size)[:, None] + offsets
+    xs = (x - half_size)[:, None] + offsets
+    inside = offsets < 2 * half_size[:, None]
+    valid_y = inside & (ys >= 0) & (ys < height)
+    valid_x = inside & (xs >= 0) & (xs < width)
+    valid = valid_y[:, :, None] & valid_x[:, None, :]
+
+    pixels = image[np.clip(ys, 0, height - 1)[:, :, None], np.clip(xs, 0, width - 1)[:, None, :]]
+    codes = np.where(valid, color_codes(pixels), NO_COLOR)
+
+    counts = count_color_codes(codes)[:, :NO_COLOR]
+    totals = np.maximum(valid.sum(axis=(1, 2)), 1)
+    percentages = counts / totals[:, None] * 100
+
+    return [COLOR_NAMES[code] for code in percentages.argmax(axis=1)], percentages
 
 def detect_led_color(image, x, y, radius):
-    # Extract the region of interest (ROI) around the circle
-    roi_size = int(radius * 2)
-    half_size = roi_size // 2
-    # Ensure ROI stays within image bounds
-    y_start = max(0, int(y - half_size))
-    y_end = min(image.shape[0], int(y + half_size))
-    x_start = max(0, int(x - half_size))
-    x_end = min(image.shape[1], int(x + half_size))
-    roi = image[y_start:y_end, x_start:x_end]
-
-    # Convert ROI to HSV
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-    
-    # Define color ranges in HSV
-    red_lower1 = np.array([0, 120, 70])
-    red_upper1 = np.array([10, 255, 255])
-    red_lower2 = np.array([170, 120, 70])
-    red_upper2 = np.array([180, 255, 255])
-    green_lower = np.array([35, 100, 100])
-    green_upper = np.array([85, 255, 255])
-    blue_lower = np.array([100, 100, 100])
-    blue_upper = np.array([130, 255, 255])
-    orange_lower = np.array([11, 150, 150])
-    orange_upper = np.array([25, 255, 255])
-
-    # Create color masks
-    red_mask1 = cv2.inRange(hsv, red_lower1, red_upper1)
-    red_mask2 = cv2.inRange(hsv, red_lower2, red_upper2)
-    red_mask = cv2.bitwise_or(red_mask1, red_mask2)
-    green_mask = cv2.inRange(hsv, green_lower, green_upper)
-    blue_mask = cv2.inRange(hsv, blue_lower, blue_upper)
-
-    # Refined orange mask
-    orange_mask_raw = cv2.inRange(hsv, orange_lower, orange_upper)
-    saturation = hsv[:, :, 1]
-    value = hsv[:, :, 2]
-    orange_mask = cv2.bitwise_and(
-        orange_mask_raw,
-        orange_mask_raw,
-        mask=cv2.inRange(saturation, 150, 255) & cv2.inRange(value, 150, 255)
-    )
+    labels, percentages = classify_led_colors(image, [(x, y, radius)])
+    dominant_color = labels[0]
+    colors = dict(zip(COLOR_NAMES, percentages[0].tolist()))
+    return dominant_color, colors, COLOR_BGR[dominant_color]
 
-    # Calculate the percentage of each color
-    red_percent = (red_mask > 0).mean() * 100
-    green_percent = (green_mask > 0).mean() * 100
-    blue_percent = (blue_mask > 0).mean() * 100
-    orange_percent = (orange_mask > 0).mean() * 100
-
-    # Determine the dominant color
-    colors = {
-        'red': red_percent,
-        'green': green_percent,
-        'blue': blue_percent,
-        'orange': orange_percent
-    }
-    dominant_color = max(colors, key=colors.get)
-
-    # Define BGR colors for drawing
-    color_map = {
-        'red': (0, 0, 255),
-        'green': (0, 255, 0),
-        'blue': (255, 0, 0),
-        'orange': (0, 165, 255)
-    }
+def build_search_tiles(led_map, frame_shape, margin):
+    """Cover the configured LEDs with non-overlapping search rectangles (x0, y0, x1, y1).
 
-    return dominant_color, colors, color_map[dominant_color]
+    Each LED gets a box wide enough for any circle that getLEDID() could match to it
+    (match radius + max Hough radius + margin); overlapping boxes are merged.
+    """
+    height, width = frame_shape[:2]
+    reach = LED_MATCH_RADIUS + HOUGH_MAX_RADIUS + margin
+    tiles = [
+        [max(0, x - reach), max(0, y - reach), min(width, x + reach + 1), min(height, y + reach + 1)]
+        for x, y in led_map.values()
+    ]
+    tiles = [tile for tile in tiles if tile[0] < tile[2] and tile[1] < tile[3]]
 
-def detect_LED(frame, stream_name):
-    global led_color_samples
-    original_image = frame.copy()
-    image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    detected_leds = 0
-    
-    if stream_name == "Camera 1":
-        height, width = image.shape[:2]
-        crop_y_start = height // 2 
-        crop_y_end = height     
-        crop_x_end = (width * 3) // 5
-        cropped_image = image[crop_y_start:crop_y_end, 0:crop_x_end]
-        cropped_image = (cropped_image / 1.7).astype(np.uint8)
-        image[crop_y_start:crop_y_end, 0:crop_x_end] = cropped_image
-    
-    _, binary_image = cv2.threshold(image, 30, 255, cv2.THRESH_BINARY)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for tile in tiles:
+            for other in result:
+                if tile[0] < other[2] and other[0] < tile[2] and tile[1] < other[3] and other[1] < tile[3]:
+                    other[0], other[1] = min(other[0], tile[0]), min(other[1], tile[1])
+                    other[2], other[3] = max(other[2], tile[2]), max(other[3], tile[3])
+                    merged = True
+                    break
+            else:
+                result.append(tile)
+        tiles = result
+
+    return [tuple(tile) for tile in tiles]
+
+def get_search_tiles(stream_name, frame_shape):
+    """Search tiles for a camera, or the whole frame when tile restriction is disabled"""
+    height, width = frame_shape[:2]
+    if HOUGH_SEARCH_MARGIN is None:
+        return [(0, 0, width, height)]
 
-    kernel = np.ones((3, 3), np.uint8)
-    dilated = cv2.dilate(binary_image, kernel, iterations=1)
-    eroded = cv2.erode(dilated, kernel, iterations=1)
-    dilated = cv2.dilate(eroded, kernel, iterations=1)
+    key = (stream_name, (height, width))
+    tiles = hough_search_tiles.get(key)
+    if tiles is None:
+        tiles = build_search_tiles(stream_led_maps.get(stream_name, {}), frame_shape, HOUGH_SEARCH_MARGIN)
+        hough_search_tiles[key] = tiles
+    return tiles
+
+def find_circles(gray, binary=None, morph=None):
+    """Threshold, clean up and run HoughCircles on a grayscale image; returns an (N, 3) float array.
+
+    binary and morph are optional preallocated buffers of the same shape as gray.
+    """
+    binary = cv2.threshold(gray, BINARY_THRESHOLD, 255, cv2.THRESH_BINARY, dst=binary)[1]
+
+    # Dilate, erode, dilate, ping-ponging between the two buffers
+    morph = cv2.dilate(binary, MORPH_KERNEL, dst=morph)
+    cv2.erode(morph, MORPH_KERNEL, dst=binary)
+    cv2.dilate(binary, MORPH_KERNEL, dst=morph)
 
     circles = cv2.HoughCircles(
-        dilated,
+        morph,
         cv2.HOUGH_GRADIENT,
         dp=1,
         minDist=10,
         param1=10,
         param2=7,
         minRadius=4,
-        maxRadius=10
+        maxRadius=HOUGH_MAX_RADIUS
     )
+    if circles is None:
+        return np.empty((0, 3), dtype=np.float32)
+    return circles[0]
 
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
-        for i in circles[0, :]:
-            center = (i[0], i[1])
-            radius = i[2]
-            ledid = getLEDID(center, stream_name)
-            
-            if ledid is not None:
-                detected_leds += 1
-                dominant_color, color_percentages, draw_color = detect_led_color(original_image, center[0], center[1], radius)
-                
-                # Add color sample with timestamp to the deque for this LED
-                led_color_samples[ledid].append({
-                    "color": dominant_color,
-                    "timestamp": time.time()
-                })
-                
-                cv2.circle(frame, center, 1, draw_color, 2)
-                cv2.circle(frame, center, radius, draw_color, 2)
-                cv2.putText(frame, f"{ledid}", (center[0] + radius + 5, center[1]), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, draw_color, 2)
-    
-    return frame, detected_leds
+class DetectionWorkspace:
+    """Per-camera buffers for the Hough engine, allocated once and reused every frame"""
+
+    def __init__(self, stream_name, frame_shape):
+        height, width = frame_shape[:2]
+        self.gray = np.empty((height, width), dtype=np.uint8)
+
+        # Over-exposed bottom-left region of Camera 1, dimmed in place through DIM_LUT
+        self.dim_region = None
+        if stream_name == "Camera 1":
+            self.dim_region = self.gray[height // 2:height, 0:(width * 3) // 5]
+
+        self.tiles = []
+        for x0, y0, x1, y1 in get_search_tiles(stream_name, frame_shape):
+            shape = (y1 - y0, x1 - x0)
+            self.tiles.append((
+                (x0, y0),
+                self.gray[y0:y1, x0:x1],
+                np.empty(shape, dtype=np.uint8),
+                np.empty(shape, dtype=np.uint8)
+            ))
+
+    def grayscale(self, frame):
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        if self.dim_region is not None:
+            cv2.LUT(self.dim_region, DIM_LUT, dst=self.dim_region)
+        return self.gray
+
+def get_detection_workspace(stream_name, frame_shape):
+    key = (stream_name, frame_shape[:2])
+    workspace = detection_workspaces.get(key)
+    if workspace is None:
+        workspace = DetectionWorkspace(stream_name, frame_shape)
+        detection_workspaces[key] = workspace
+    return workspace
+
+def detect_leds_hough(frame, stream_name):
+    """Find lit LEDs with threshold, morphology and HoughCircles inside the search tiles"""
+    workspace = get_detection_workspace(stream_name, frame.shape)
+    workspace.grayscale(frame)
+
+    # Run the search per tile and shift the circles back to full-frame coordinates
+    found = []
+    for (x0, y0), gray, binary, morph in workspace.tiles:
+        circles = find_circles(gray, binary, morph)
+        if len(circles):
+            circles[:, 0] += x0
+            circles[:, 1] += y0
+            found.append(circles)
+
+    if not found:
+        return []
+
+    circles = np.uint16(np.around(np.concatenate(found)))
+    led_ids = getLEDIDs(circles[:, :2], stream_name)
+    matched = [i for i, ledid in enumerate(led_ids) if ledid is not None]
+    circles = circles[matched]
+    colors, _ = classify_led_colors(frame, circles)
+
+    return [
+        (led_ids[i], (x, y), radius, color)
+        for i, (x, y, radius), color in zip(matched, circles.tolist(), colors)
+    ]
+
+class LEDStencils:
+    """Circular sampling stencils at the configured LED positions of one camera.
+
+    Built once per camera and frame size; sample() then reads every LED's disc
+    with a single gather and decides on/off and colour for all of them at once.
+    """
+
+    def __init__(self, led_map, frame_shape, stream_name, radius=STENCIL_RADIUS):
+        height, width = frame_shape[:2]
+        self.ids = list(led_map.keys())
+        self.radius = radius
+        points = np.array([led_map[key] for key in self.ids], dtype=np.int64).reshape(-1, 2)
+        self.centers = [tuple(point) for point in points.tolist()]
+
+        dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        disc = dx ** 2 + dy ** 2 <= radius ** 2
+        xs = points[:, 0, None] + dx[disc]
+        ys = points[:, 1, None] + dy[disc]
+
+        # Pixels falling off the frame are clamped for the gather and masked out of the statistics
+        self.valid = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        self.valid_counts = np.maximum(self.valid.sum(axis=1), 1)
+        self.xs = np.clip(xs, 0, width - 1)
+        self.ys = np.clip(ys, 0, height - 1)
+
+        # Mirror the Camera 1 dimming applied before thresholding in the Hough engine
+        self.dimmed = np.zeros(len(self.ids), dtype=bool)
+        if stream_name == "Camera 1":
+            self.dimmed = (points[:, 1] >= height // 2) & (points[:, 0] < (width * 3) // 5)
+
+    def sample(self, frame):
+        """Return (led_id, center, radius, color) for every lit LED in the frame"""
+        if not self.ids:
+            return []
+
+        pixels = frame[self.ys, self.xs]  # (LEDs, stencil pixels, BGR)
+
+        gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+        gray[self.dimmed] = DIM_LUT[gray[self.dimmed]]
+        lit_fraction = ((gray > BINARY_THRESHOLD) & self.valid).sum(axis=1) / self.valid_counts
+        lit = lit_fraction >= STENCIL_ON_FRACTION
+        if not lit.any():
+            return []
+
+        # Count each LED's stencil pixels per color with one bincount over (LED, code) pairs
+        codes = np.where(self.valid, color_codes(pixels), NO_COLOR)
+        counts = count_color_codes(codes)
+        dominant = counts[:, :NO_COLOR].argmax(axis=1)
+
+        return [
+            (self.ids[i], self.centers[i], self.radius, COLOR_NAMES[dominant[i]])
+            for i in np.flatnonzero(lit)
+        ]
+
+def detect_leds_stencil(frame, stream_name):
+    """Sample the configured LED positions directly instead of searching for circles"""
+    key = (stream_name, frame.shape[:2])
+    stencils = led_stencils.get(key)
+    if stencils is None:
+        stencils = LEDStencils(stream_led_maps.get(stream_name, {}), frame.shape, stream_name)
+        led_stencils[key] = stencils
+    return stencils.sample(frame)
+
+def run_detection(frame, stream_name):
+    """Run the camera's configured engine; returns [(led_id, center, radius, color), ...]"""
+    if detection_engines.get(stream_name, "hough") == "stencil":
+        return detect_leds_stencil(frame, stream_name)
+    return detect_leds_hough(frame, stream_name)
+
+class LEDSampleHistory:
+    """The last SAMPLE_HISTORY color samples of every LED, as (n_leds, capacity) arrays.
+
+    Row i belongs to led_ids[i] and counts[i] is the number of samples ever appended
+    for it, so its newest sample sits in column (counts[i] - 1) % capacity.
+
+    Samples from starts[i] up to counts[i] are the LED's window, and color_counts
+    holds the number of each color in it. Appends add to the counts, and samples
+    leave the window (and the counts) when they are overwritten or expire, so the
+    mode of every LED can be read without rescanning the samples.
+
+    streak_codes and streak_lengths hold the color of each LED's newest sample and
+    how many samples in a row, up to and including it, showed that color;
+    streak_starts holds the timestamp of the first of them.
+    """
+
+    def __init__(self, n_leds, capacity=SAMPLE_HISTORY):
+        self.capacity = capacity
+        self.codes = np.full((n_leds, capacity), NO_COLOR, dtype=np.uint8)
+        self.timestamps = np.full((n_leds, capacity), -np.inf)
+        self.counts = np.zeros(n_leds, dtype=np.int64)
+        self.starts = np.zeros(n_leds, dtype=np.int64)
+        self.color_counts = np.zeros((n_leds, len(COLOR_NAMES)), dtype=np.int64)
+        self.streak_codes = np.full(n_leds, NO_COLOR, dtype=np.uint8)
+        self.streak_lengths = np.zeros(n_leds, dtype=np.int64)
+        self.streak_starts = np.full(n_leds, -np.inf)
+        self.lock = threading.Lock()  # Camera threads append while request handlers read
+
+    def append(self, leds, codes, timestamps):
+        """Append one sample per entry; leds are positions in led_ids and may repeat"""
+        leds = np.asarray(leds, dtype=np.int64)
+        if len(leds) == 0:
+            return
+
+        # Samples of the same LED within one batch take consecutive slots, in batch order;
+        # only the last capacity of them would survive, so drop the rest up front
+        order = np.argsort(leds, kind='stable')
+        leds = leds[order]
+        first = np.r_[0, np.flatnonzero(np.diff(leds)) + 1]
+        sizes = np.diff(np.r_[first, len(leds)])
+        surplus = np.repeat(np.maximum(sizes - self.capacity, 0), sizes)
+        ranks = np.arange(len(leds)) - np.repeat(first, sizes) - surplus
+        keep = ranks >= 0
+        leds, ranks, order = leds[keep], ranks[keep], order[keep]
+        codes = np.asarray(codes, dtype=np.uint8)[order]
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), keep.shape)[order]
+        added = np.bincount(leds, minlength=len(self.counts))
+
+        # Per LED in the batch: its last code, and how many samples at the end of its run show it
+        first = np.r_[0, np.flatnonzero(np.diff(leds)) + 1]
+        last = np.r_[first[1:], len(leds)] - 1
+        changed = np.ones(len(leds), dtype=bool)
+        changed[1:] = (codes[1:] != codes[:-1]) | (leds[1:] != leds[:-1])
+        last_change = np.maximum.accumulate(np.where(changed, np.arange(len(leds)), 0))[last]
+        batch_leds, last_codes, tail_lengths = leds[first], codes[last], last - last_change + 1
+
+        with self.lock:
+            # Retire the samples about to be overwritten before their slots are reused
+            self._retire(lambda rows: self.starts[rows] < self.counts[rows] + added[rows] - self.capacity)
+
+            slots = (self.counts[leds] + ranks) % self.capacity
+            self.codes[leds, slots] = codes
+            self.timestamps[leds, slots] = timestamps
+            self.counts += added
+            self.color_counts += np.bincount(leds * len(COLOR_NAMES) + codes,
+                                             minlength=self.color_counts.size).reshape(self.color_counts.shape)
+
+            # A streak carries on only if the whole run matches the LED's current streak color
+            carries_on = (last_change == first) & (self.streak_codes[batch_leds] == last_codes)
+            self.streak_lengths[batch_leds] = np.where(carries_on, self.streak_lengths[batch_leds] + tail_lengths, tail_lengths)
+            self.streak_starts[batch_leds] = np.where(carries_on, self.streak_starts[batch_leds], timestamps[last_change])
+            self.streak_codes[batch_leds] = last_codes
+
+    def _retire(self, is_stale):
+        """Move window starts past their oldest sample while is_stale(rows) says so; call with the lock held"""
+        rows = np.flatnonzero(self.starts < self.counts)
+        while len(rows):
+            rows = rows[is_stale(rows)]
+            if not len(rows):
+                break
+            # Rows are unique, so plain fancy indexing is safe here
+            self.color_counts[rows, self.codes[rows, self.starts[rows] % self.capacity]] -= 1
+            self.starts[rows] += 1
+            rows = rows[self.starts[rows] < self.counts[rows]]
+
+    def window_color_counts(self, since):
+        """Count of each color in every LED's window after expiring samples older than since"""
+        with self.lock:
+            self._retire(lambda rows: self.timestamps[rows, self.starts[rows] % self.capacity] < since)
+            return self.color_counts.copy()
+
+    def streaks(self, since, seen_since):
+        """(color code, length) of every LED's current streak, counting only samples in its window
+        after expiring samples older than since; NO_COLOR if its newest sample is older than seen_since"""
+        with self.lock:
+            self._retire(lambda rows: self.timestamps[rows, self.starts[rows] % self.capacity] < since)
+            newest = self.timestamps[np.arange(len(self.counts)), (self.counts - 1) % self.capacity]
+            codes = np.where((self.counts > 0) & (newest >= seen_since), self.streak_codes, NO_COLOR)
+            return codes, np.minimum(self.streak_lengths, self.counts - self.starts)
+
+    def restart_windows(self, flipped, since):
+        """Start the window of each flipped LED at its current streak, and of every other LED at since"""
+        with self.lock:
+            limits = self.counts - self.streak_lengths
+            self._retire(lambda rows: np.where(flipped[rows], self.starts[rows] < limits[rows],
+                                               self.timestamps[rows, self.starts[rows] % self.capacity] < since))
+
+    def last_seen(self):
+        """Timestamp of every LED's newest sample, -inf if it has none"""
+        with self.lock:
+            return self.timestamps[np.arange(len(self.counts)), (self.counts - 1) % self.capacity].copy()
+
+    def sample_counts(self):
+        """Number of samples currently held per LED"""
+        return np.minimum(self.counts, self.capacity)
+
+    def recent(self, led, limit=None):
+        """Color codes of one LED's held samples, oldest first"""
+        with self.lock:
+            count = int(self.counts[led])
+            held = min(count, self.capacity, limit or self.capacity)
+            return self.codes[led, np.arange(count - held, count) % self.capacity]
+
+    def clear(self, led=None):
+        """Drop the samples of one LED, or of all LEDs"""
+        rows = slice(None) if led is None else led
+        with self.lock:
+            self.codes[rows] = NO_COLOR
+            self.timestamps[rows] = -np.inf
+            self.counts[rows] = 0
+            self.starts[rows] = 0
+            self.color_counts[rows] = 0
+            self.streak_codes[rows] = NO_COLOR
+            self.streak_lengths[rows] = 0
+            self.streak_starts[rows] = -np.inf
+
+def record_detections(detections, timestamp):
+    """Add one color sample per detected LED"""
+    if not detections:
+        return
+    leds = [led_id_table[ledid] for ledid, _, _, _ in detections]
+    codes = [COLOR_CODES[dominant_color] for _, _, _, dominant_color in detections]
+    led_samples.append(leds, codes, timestamp)
 
 def create_pipeline():
     
@@ -231,17 +900,17 @@ def calculate_image_quality_score(image, led_count):
     
     return total_score
 
-def update_best_image(image, total_leds):
+def update_best_image(view, total_leds):
     """Update the best image using enhanced quality assessment"""
     global best_image_data
     current_time = time.time()
     
     # Calculate quality score for this image
-    quality_score = calculate_image_quality_score(image, total_leds)
+    quality_score = calculate_image_quality_score(view["image"], total_leds)
     
-    # Add to recent images with quality score
+    # Add to recent images with quality score (views are never modified, so no copy is needed)
     best_image_data["recent_images"].append({
-        "image": image.copy(),
+        "view": view,
         "led_count": total_leds,
         "quality_score": quality_score,
         "timestamp": current_time
@@ -255,11 +924,274 @@ def update_best_image(image, total_leds):
     
     # Update best image if this one has better quality score
     if quality_score > best_image_data["quality_score"]:
-        best_image_data["image"] = image.copy()
+        best_image_data["view"] = view
         best_image_data["led_count"] = total_leds
         best_image_data["quality_score"] = quality_score
         best_image_data["timestamp"] = current_time
 
+def build_crop_transform(source_shape, crop):
+    """Inverse affine map from crop pixels to source pixels for resize -> rotate 180 -> crop.
+
+    Returns the 2x3 matrix and the (width, height) of the crop.
+    """
+    source_height, source_width = source_shape[:2]
+    width, height = CAMERA_RESIZE
+    scale_x = source_width / width
+    scale_y = source_height / height
+    y0, y1, x0, x1 = crop
+
+    # Crop pixel (u, v) is resized pixel (width - 1 - x0 - u, height - 1 - y0 - v) before the
+    # rotation, and cv2.resize samples resized pixel X at source (X + 0.5) * scale - 0.5
+    matrix = np.array([
+        [-scale_x, 0, (width - 1 - x0 + 0.5) * scale_x - 0.5],
+        [0, -scale_y, (height - 1 - y0 + 0.5) * scale_y - 0.5]
+    ])
+    return matrix, (x1 - x0, y1 - y0)
+
+def extract_camera_crop(frame, stream_name):
+    """Produce a camera's rotated, resized crop straight from the source frame in one warpAffine"""
+    key = (stream_name, frame.shape[:2])
+    transform = crop_transforms.get(key)
+    if transform is None:
+        transform = build_crop_transform(frame.shape, CAMERA_CROPS[stream_name])
+        crop_transforms[key] = transform
+
+    matrix, size = transform
+    return cv2.warpAffine(frame, matrix, size, flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def assign_stream_names(device_infos):
+    """Name each OAK device "Camera 1" or "Camera 2" from its MxId prefix"""
+    stream_names = []
+    for i, device_info in enumerate(device_infos):
+        stream_name = "Camera 1" if device_info.getMxId().startswith("144") else "Camera 2"
+        if i > 0:
+            stream_name = "Camera 2" if device_info.getMxId().startswith("184") else "Camera 1"
+        stream_names.append(stream_name)
+    return stream_names
+
+def combine_frames(frame1, frame2):
+    """Pad the shorter frame at the top and stack both side by side"""
+    # Calculate heights and pad if necessary
+    h1, w1 = frame1.shape[:2]
+    h2, w2 = frame2.shape[:2]
+    max_height = max(h1, h2)
+
+    if h1 < max_height:
+        pad_height = max_height - h1
+        frame1 = np.pad(frame1, ((pad_height, 0), (0, 0), (0, 0)), mode='constant', constant_values=0)
+    elif h2 < max_height:
+        pad_height = max_height - h2
+        frame2 = np.pad(frame2, ((pad_height, 0), (0, 0), (0, 0)), mode='constant', constant_values=0)
+
+    # Stack frames horizontally
+    return np.hstack((frame1, frame2))
+
+def make_frame_view(image, stream_name, detections):
+    """Bundle a raw camera frame with its detections; overlays are drawn later by render_view().
+
+    A view's layout lists (stream_name, x_offset, y_offset) for each camera it contains,
+    and its detections hold one list per layout entry, in that camera's own coordinates.
+    Every view gets a new generation, increasing in the order views are made.
+    """
+    return {
+        "image": image,
+        "layout": ((stream_name, 0, 0),),
+        "detections": (detections,),
+        "generation": next(frame_generations)
+    }
+
+def combine_views(view1, view2):
+    """Side-by-side view of two frame views, laid out like combine_frames()"""
+    image = combine_frames(view1["image"], view2["image"])
+    pad1 = image.shape[0] - view1["image"].shape[0]
+    pad2 = image.shape[0] - view2["image"].shape[0]
+    x_offset2 = view1["image"].shape[1]
+
+    layout = tuple((name, x, y + pad1) for name, x, y in view1["layout"]) + \
+        tuple((name, x + x_offset2, y + pad2) for name, x, y in view2["layout"])
+    return {
+        "image": image,
+        "layout": layout,
+        "detections": view1["detections"] + view2["detections"],
+        "generation": next(frame_generations)
+    }
+
+def get_label_layer(layout, shape):
+    """Static label layer for a view layout: every pixel covered by an LED label holds
+    (layout entry * len(led_ids) + LED position), all other pixels hold -1.
+
+    Labels are rendered once per layout with putText; render_view() then colours the
+    labels of the detected LEDs with a single lookup into this map.
+    """
+    key = (layout, shape[:2])
+    owner = label_layers.get(key)
+    if owner is not None:
+        return owner
+
+    height, width = shape[:2]
+    owner = np.full((height, width), -1, dtype=np.int32)
+    font, scale, thickness = cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2
+
+    for slot, (stream_name, x_offset, y_offset) in enumerate(layout):
+        for led_id, (x, y) in stream_led_maps.get(stream_name, {}).items():
+            (text_w, text_h), baseline = cv2.getTextSize(led_id, font, scale, thickness)
+            patch = np.zeros((text_h + baseline + 2 * thickness, text_w + 2 * thickness), dtype=np.uint8)
+            cv2.putText(patch, led_id, (thickness, text_h + thickness), font, scale, 255, thickness)
+
+            # Paste the patch so the text baseline sits where cv2.putText would have put it
+            left = x + x_offset + LABEL_OFFSET_X - thickness
+            top = y + y_offset - text_h - thickness
+            x0, y0 = max(left, 0), max(top, 0)
+            x1, y1 = min(left + patch.shape[1], width), min(top + patch.shape[0], height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            region = owner[y0:y1, x0:x1]
+            region[patch[y0 - top:y1 - top, x0 - left:x1 - left] > 0] = slot * len(led_ids) + led_id_table[led_id]
+
+    label_layers[key] = owner
+    return owner
+
+def render_view(view):
+    """Draw the detections of a frame view onto a copy of its raw image"""
+    image = view["image"].copy()
+    slot_size = len(led_ids)
+    # One extra entry so the -1 of unlabeled pixels indexes an unlit slot
+    label_colors = np.zeros((len(view["layout"]) * slot_size + 1, 3), dtype=np.uint8)
+    label_lit = np.zeros(len(label_colors), dtype=bool)
+
+    for slot, ((_, x_offset, y_offset), detections) in enumerate(zip(view["layout"], view["detections"])):
+        for ledid, (x, y), radius, dominant_color in detections:
+            draw_color = COLOR_BGR[dominant_color]
+            center = (x + x_offset, y + y_offset)
+            cv2.circle(image, center, 1, draw_color, 2)
+            cv2.circle(image, center, radius, draw_color, 2)
+
+            code = slot * slot_size + led_id_table[ledid]
+            label_lit[code] = True
+            label_colors[code] = draw_color
+
+    if label_lit.any():
+        owner = get_label_layer(view["layout"], image.shape)
+        mask = label_lit[owner]
+        image[mask] = label_colors[owner[mask]]
+
+    return image
+
+def open_live_feed_window():
+    # Create resizable window for combined frame like in LED_missingsockets.py
+    cv2.namedWindow("LED Detection Server - Live Feed", cv2.WINDOW_NORMAL)
+    cv2.setWindowProperty("LED Detection Server - Live Feed", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+    cv2.setWindowProperty("LED Detection Server - Live Feed", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_NORMAL)
+
+def preview_worker():
+    """Show the latest combined frame at preview_fps, independently of the detection loop"""
+    open_live_feed_window()
+    shown = None
+    try:
+        while camera_thread is not None and camera_thread.is_alive():
+            view = combined_frame
+            if view is not None and view is not shown:
+                shown = view
+                if not show_live_feed(render_view(view)):
+                    break
+            else:
+                cv2.waitKey(1)  # Keep the window responsive
+            time.sleep(1.0 / preview_fps)
+    except Exception as e:
+        print(f"Preview error: {e}")
+    finally:
+        cv2.destroyAllWindows()
+        print("Camera windows closed")
+
+def show_live_feed(frame):
+    """Display the combined frame; returns False once ESC has been pressed"""
+    global camera_running
+
+    # Display the combined frame (let window handle resizing)
+    cv2.imshow('LED Detection Server - Live Feed', frame)
+
+    # Check for ESC key to exit
+    key = cv2.waitKey(1) & 0xFF
+    if key == 27:  # ESC key
+        print("\nESC pressed - Stopping server...")
+        camera_running = False
+        return False
+    return True
+
+class FrameRateMeter:
+    """Frame rate over a sliding window, plus frames lost before they reached us"""
+
+    def __init__(self, window=FPS_WINDOW_SECONDS):
+        self.window = window
+        self.ticks = deque()
+        self.last_sequence = None
+        self.dropped = 0
+
+    def tick(self, sequence=None):
+        now = time.time()
+        self.ticks.append(now)
+        self._expire(now)
+
+        # Gaps in the device sequence numbers are frames dropped on the way (e.g. by a full output queue)
+        if sequence is not None:
+            if self.last_sequence is not None and sequence > self.last_sequence + 1:
+                self.dropped += sequence - self.last_sequence - 1
+            self.last_sequence = sequence
+
+    def rate(self):
+        self._expire(time.time())
+        return len(self.ticks) / self.window
+
+    def _expire(self, now):
+        while self.ticks and self.ticks[0] < now - self.window:
+            self.ticks.popleft()
+
+class FrameHandoff:
+    """Latest-frame-wins handoff from the capture reader threads to the detection loop"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.superseded = defaultdict(int)  # Frames replaced before detection got to them
+
+    def put(self, stream_name, packet):
+        with self.condition:
+            if stream_name in self.pending:
+                self.superseded[stream_name] += 1
+            self.pending[stream_name] = packet
+            self.condition.notify()
+
+    def take(self, timeout=0.5):
+        """Wait for new frames and return {stream_name: packet}"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending, timeout=timeout)
+            packets, self.pending = self.pending, {}
+        return packets
+
+def camera_reader(q_rgb, stream_name, handoff, meter, is_running):
+    """Block on a device's output queue and hand every frame to the detection loop"""
+    while is_running():
+        try:
+            packet = q_rgb.get()
+        except RuntimeError:
+            break  # Device closed
+        meter.tick(packet.getSequenceNum())
+        handoff.put(stream_name, packet)
+
+def start_camera_reader(q_rgb, stream_name, handoff, meter, is_running):
+    reader = threading.Thread(target=camera_reader, args=(q_rgb, stream_name, handoff, meter, is_running),
+                              name=f"{stream_name} reader", daemon=True)
+    reader.start()
+    return reader
+
+def frame_rate_stats(capture_meter, processed_meter, superseded):
+    return {
+        "capture_fps": round(capture_meter.rate(), 1),
+        "processed_fps": round(processed_meter.rate(), 1),
+        "dropped_frames": capture_meter.dropped + superseded
+    }
+
 def camera_worker():
     global current_frames, combined_frame, camera_running
     
@@ -270,148 +1202,443 @@ def camera_worker():
                 print(f"Only {len(device_infos)} camera(s) detected. Two cameras required.")
                 return
 
-            q_rgb_map = []
             usb_speed = dai.UsbSpeed.SUPER
-            devicesID = []
+            handoff = FrameHandoff()
+            capture_meters = {}
+            processed_meters = {}
+            camera_running = True
             
-            for i, device_info in enumerate(device_infos):
+            for device_info, stream_name in zip(device_infos, assign_stream_names(device_infos)):
                 device = stack.enter_context(dai.Device(create_pipeline(), device_info, usb_speed))
                 q_rgb = device.getOutputQueue(name="rgb", maxSize=4, blocking=False)
-                devicesID.append(device_info.getMxId())
-                stream_name = "Camera 1" if device_info.getMxId().startswith("144") else "Camera 2"
-                if len(devicesID) > 1:
-                    stream_name = "Camera 2" if device_info.getMxId().startswith("184") else "Camera 1"
-
-                q_rgb_map.append((q_rgb, stream_name))
+                capture_meters[stream_name] = FrameRateMeter()
+                processed_meters[stream_name] = FrameRateMeter()
+                start_camera_reader(q_rgb, stream_name, handoff, capture_meters[stream_name], lambda: camera_running)
                 print(f"Connected to {stream_name} with ID: {device_info.getMxId()}")
 
-            camera_running = True
-            
-            # Create resizable window for combined frame like in LED_missingsockets.py
-            cv2.namedWindow("LED Detection Server - Live Feed", cv2.WINDOW_NORMAL)
-            cv2.setWindowProperty("LED Detection Server - Live Feed", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-            cv2.setWindowProperty("LED Detection Server - Live Feed", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_NORMAL)
+            frames = {}
+            frame_led_counts = {}
             
             while camera_running:
-                frames = {}
-                frame_led_counts = {}
-                
-                for q_rgb, stream_name in q_rgb_map:
-                    if q_rgb.has():
-                        frame = q_rgb.get().getCvFrame()
-                        frame = cv2.resize(frame, (1706, 960))
-                        frame = np.rot90(frame, 2)
-                        frame = np.ascontiguousarray(frame)
-                        
-                        if stream_name == "Camera 2": 
-                            frame = frame[120:820, 500:1502]
-                            frame2=frame
-                        else: 
-                            frame = frame[250:820, 340:1451]
-                            frame1=frame
-                    
-                        frame, led_count = detect_LED(frame, stream_name)
-                        frames[stream_name] = frame
-                        frame_led_counts[stream_name] = led_count
-                        current_frames[stream_name] = frame.copy()
+                packets = handoff.take()
+                if not packets:
+                    continue
+
+                for stream_name, packet in packets.items():
+                    frame = extract_camera_crop(packet.getCvFrame(), stream_name)
+                    detections = run_detection(frame, stream_name)
+                    record_detections(detections, time.time())
+
+                    # Keep the raw frame; overlays are only drawn when someone asks for an image
+                    frames[stream_name] = make_frame_view(frame, stream_name, detections)
+                    frame_led_counts[stream_name] = len(detections)
+                    current_frames[stream_name] = frames[stream_name]
 
+                    processed_meters[stream_name].tick()
+                    camera_frame_rates[stream_name] = frame_rate_stats(
+                        capture_meters[stream_name], processed_meters[stream_name], handoff.superseded[stream_name])
+
+                publish_led_snapshot()
+
+                # Recombine whenever either camera delivers, using the other camera's latest frame
                 if len(frames) == 2:
-                    #frame1 = frames["Camera 1"] if devicesID[0].startswith("144") else frames["Camera 2"]
-                    #frame2 = frames["Camera 2"] if devicesID[1].startswith("184") else frames["Camera 1"]
-
-                    # Calculate heights and pad if necessary
-                    h1, w1 = frame1.shape[:2]
-                    h2, w2 = frame2.shape[:2]
-                    max_height = max(h1, h2)
-
-                    if h1 < max_height:
-                        pad_height = max_height - h1
-                        frame1 = np.pad(frame1, ((pad_height, 0), (0, 0), (0, 0)), mode='constant', constant_values=0)
-                    elif h2 < max_height:
-                        pad_height = max_height - h2
-                        frame2 = np.pad(frame2, ((pad_height, 0), (0, 0), (0, 0)), mode='constant', constant_values=0)
-
-                    # Stack frames horizontally
-                    combined_frame = np.hstack((frame1, frame2))
-                    
-                    # Display the combined frame (let window handle resizing)
-                    cv2.imshow('LED Detection Server - Live Feed', combined_frame)
-                    
-                    # Check for ESC key to exit
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == 27:  # ESC key
-                        print("\nESC pressed - Stopping server...")
-                        camera_running = False
-                        break
+                    combined_frame = combine_views(frames["Camera 1"], frames["Camera 2"])
                     
                     # Update best image based on total LED count
                     total_led_count = sum(frame_led_counts.values())
                     update_best_image(combined_frame, total_led_count)
-
-                time.sleep(0.033)  # ~30 FPS
                 
     except Exception as e:
         print(f"Camera worker error: {e}")
         camera_running = False
+
+class SharedFrameRing:
+    """Single-writer ring of fixed-size frames in shared memory.
+
+    Header (int64): latest sequence number, then the sequence number and LED count
+    held by each slot. A slot's sequence is set to -1 while it is being written, so
+    readers can tell whether a view they hold has since been overwritten. The writer
+    also keeps its frame rate stats (capture fps, processed fps, dropped frames) here.
+    """
+
+    def __init__(self, shape, slots=FRAME_RING_SLOTS, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        header_size = 8 * (1 + 2 * slots)
+        stats_size = 8 * 3
+        frame_size = int(np.prod(self.shape))
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+                                              size=header_size + stats_size + slots * frame_size)
+        self.name = self.shm.name
+        self.header = np.ndarray((1 + 2 * slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.stats = np.ndarray((3,), dtype=np.float64, buffer=self.shm.buf, offset=header_size)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                 offset=header_size + stats_size)
+        if create:
+            self.header[:] = 0
+            self.stats[:] = 0
+
+    def write(self, frame, led_count):
+        seq = int(self.header[0]) + 1
+        slot = seq % self.slots
+        self.header[1 + slot] = -1
+        self.frames[slot] = frame
+        self.header[1 + self.slots + slot] = led_count
+        self.header[1 + slot] = seq
+        self.header[0] = seq
+
+    def latest(self):
+        """Return (seq, frame view, led count) of the newest frame; the view is zero-copy and read-only"""
+        seq = int(self.header[0])
+        if seq == 0:
+            return 0, None, 0
+        slot = seq % self.slots
+        view = self.frames[slot]
+        view.flags.writeable = False
+        return seq, view, int(self.header[1 + self.slots + slot])
+
+    def is_intact(self, seq):
+        """Whether the slot of frame seq still holds it, i.e. a view or copy taken of it is not torn"""
+        return self.header[1 + seq % self.slots] == seq
+
+    def close(self, unlink=False):
+        del self.header, self.stats, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A reader still holds a view; the mapping is released with its last reference
+        if unlink:
+            self.shm.unlink()
+
+class SharedSampleRing:
+    """Single-writer ring of per-LED detection records (DETECTION_DTYPE) in shared memory.
+
+    The header holds the total number of records ever written; readers keep their
+    own cursor into that count and skip ahead if the writer has lapped them.
+    """
+
+    def __init__(self, capacity=SAMPLE_RING_CAPACITY, name=None):
+        self.capacity = capacity
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=8 + capacity * DETECTION_DTYPE.itemsize)
+        self.name = self.shm.name
+        self.header = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=DETECTION_DTYPE, buffer=self.shm.buf, offset=8)
+        if create:
+            self.header[0] = 0
+
+    def write(self, records):
+        count = int(self.header[0])
+        self.records[(count + np.arange(len(records))) % self.capacity] = records
+        self.header[0] = count + len(records)
+
+    def read(self, cursor):
+        """Return (new cursor, copy of the records written since cursor)"""
+        count = int(self.header[0])
+        cursor = max(cursor, count - self.capacity)
+        if cursor >= count:
+            return count, self.records[:0].copy()
+        return count, self.records[np.arange(cursor, count) % self.capacity]
+
+    def close(self, unlink=False):
+        del self.header, self.records
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A reader still holds a view; the mapping is released with its last reference
+        if unlink:
+            self.shm.unlink()
+
+def camera_process_main(device_id, stream_name, frame_ring_name, sample_ring_name, engines, search_margin, stop_event):
+    """Capture and detection loop for one OAK device, run in its own process"""
+    global HOUGH_SEARCH_MARGIN
+    detection_engines.update(engines)
+    HOUGH_SEARCH_MARGIN = search_margin
+    load_config()
+
+    frame_ring = SharedFrameRing(CAMERA_FRAME_SHAPES[stream_name], name=frame_ring_name)
+    sample_ring = SharedSampleRing(name=sample_ring_name)
+    handoff = FrameHandoff()
+    capture_meter = FrameRateMeter()
+    processed_meter = FrameRateMeter()
+
+    try:
+        device_info = dai.DeviceInfo(device_id)
+        with dai.Device(create_pipeline(), device_info, dai.UsbSpeed.SUPER) as device:
+            q_rgb = device.getOutputQueue(name="rgb", maxSize=4, blocking=False)
+            start_camera_reader(q_rgb, stream_name, handoff, capture_meter, lambda: not stop_event.is_set())
+            print(f"Connected to {stream_name} with ID: {device_id} (pid {os.getpid()})")
+
+            while not stop_event.is_set():
+                packet = handoff.take().get(stream_name)
+                if packet is None:
+                    continue
+
+                frame = extract_camera_crop(packet.getCvFrame(), stream_name)
+                detections = run_detection(frame, stream_name)
+                timestamp = time.time()
+                seq = int(frame_ring.header[0]) + 1
+
+                records = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+                for i, (ledid, (x, y), radius, dominant_color) in enumerate(detections):
+                    records[i] = (seq, led_id_table[ledid], COLOR_CODES[dominant_color],
+                                  radius, x, y, timestamp)
+                sample_ring.write(records)
+                frame_ring.write(frame, len(detections))
+
+                processed_meter.tick()
+                stats = frame_rate_stats(capture_meter, processed_meter, handoff.superseded[stream_name])
+                frame_ring.stats[:] = (stats["capture_fps"], stats["processed_fps"], stats["dropped_frames"])
+    except Exception as e:
+        print(f"{stream_name} process error: {e}")
     finally:
-        cv2.destroyAllWindows()
-        print("Camera windows closed")
+        frame_ring.close()
+        sample_ring.close()
 
-def get_led_mode_color(led_id: str) -> Optional[str]:
-    """Get the most frequent color for an LED based on samples from last 5 seconds with improved confidence"""
-    if led_id not in led_color_samples or len(led_color_samples[led_id]) == 0:
-        return None  # Not detected
-    
-    current_time = time.time()
-    recent_samples = []
-    
-    # Filter samples to only include those from the last 5 seconds (increased from 3)
-    for sample in led_color_samples[led_id]:
-        if isinstance(sample, dict) and "timestamp" in sample:
-            if current_time - sample["timestamp"] <= 5.0:  # Last 5 seconds for more stable detection
-                recent_samples.append(sample["color"])
-        else:
-            # Handle old format samples (just color strings) - treat as expired
-            continue
-    
-    # Require minimum samples for reliable detection (at least 5 frames)
-    if len(recent_samples) < 5:
-        return None  # Not enough samples for reliable detection
-    
-    # Count occurrences of each color in recent samples
-    color_counts = {
-        'red': 0,
-        'green': 0,
-        'blue': 0,
-        'orange': 0
+def camera_process_supervisor():
+    """Run one detection process per OAK device and collect their results from shared memory"""
+    global current_frames, combined_frame, camera_running
+
+    device_infos = dai.Device.getAllAvailableDevices()[:2]
+    if len(device_infos) < 2:
+        print(f"Only {len(device_infos)} camera(s) detected. Two cameras required.")
+        return
+
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    rings = {}
+    processes = []
+
+    try:
+        for device_info, stream_name in zip(device_infos, assign_stream_names(device_infos)):
+            frame_ring = SharedFrameRing(CAMERA_FRAME_SHAPES[stream_name])
+            sample_ring = SharedSampleRing()
+            rings[stream_name] = (frame_ring, sample_ring)
+            process = context.Process(
+                target=camera_process_main,
+                args=(device_info.getMxId(), stream_name, frame_ring.name, sample_ring.name,
+                      dict(detection_engines), HOUGH_SEARCH_MARGIN, stop_event),
+                daemon=True
+            )
+            process.start()
+            processes.append(process)
+
+        camera_running = True
+
+        cursors = {stream_name: 0 for stream_name in rings}
+        last_seqs = {stream_name: 0 for stream_name in rings}
+        pending_detections = {stream_name: defaultdict(list) for stream_name in rings}
+        fresh = set()
+        frame_led_counts = {}
+
+        while camera_running:
+            for stream_name, (frame_ring, sample_ring) in rings.items():
+                cursors[stream_name], records = sample_ring.read(cursors[stream_name])
+                led_samples.append(records["led"], records["color"], records["timestamp"])
+                for seq, led, color, radius, x, y, _ in records.tolist():
+                    pending_detections[stream_name][seq].append((led_ids[led], (x, y), radius, COLOR_NAMES[color]))
+
+                capture_fps, processed_fps, dropped = frame_ring.stats.tolist()
+                camera_frame_rates[stream_name] = {
+                    "capture_fps": capture_fps,
+                    "processed_fps": processed_fps,
+                    "dropped_frames": int(dropped)
+                }
+
+                # Records are written before their frame, so wait for them if this frame had detections
+                seq, frame, led_count = frame_ring.latest()
+                detections_by_seq = pending_detections[stream_name]
+                if seq != last_seqs[stream_name] and (led_count == 0 or seq in detections_by_seq):
+                    # Copy out of the ring: views outlive the slot (queued encodes, streams), and a
+                    # copy the writer lapped while it was taken is dropped in favour of the next frame
+                    frame = frame.copy()
+                    if not frame_ring.is_intact(seq):
+                        continue
+                    last_seqs[stream_name] = seq
+                    current_frames[stream_name] = make_frame_view(frame, stream_name, detections_by_seq.pop(seq, []))
+                    for old_seq in [key for key in detections_by_seq if key < seq]:
+                        del detections_by_seq[old_seq]
+                    frame_led_counts[stream_name] = led_count
+                    fresh.add(stream_name)
+
+            if fresh:
+                publish_led_snapshot()
+
+            # Recombine whenever either camera delivers, once both have produced a frame
+            if fresh and len(last_seqs) == 2 and all(last_seqs.values()):
+                fresh.clear()
+                combined_frame = combine_views(current_frames["Camera 1"], current_frames["Camera 2"])
+
+                # Update best image based on total LED count
+                update_best_image(combined_frame, sum(frame_led_counts.values()))
+
+            if not any(process.is_alive() for process in processes):
+                print("All camera processes have exited")
+                break
+
+            time.sleep(0.005)
+
+    except Exception as e:
+        print(f"Camera supervisor error: {e}")
+    finally:
+        camera_running = False
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=5)
+        frame = None
+        current_frames.update({stream_name: None for stream_name in rings})
+        combined_frame = None
+        for frame_ring, sample_ring in rings.values():
+            frame_ring.close(unlink=True)
+            sample_ring.close(unlink=True)
+
+def mode_color_codes(color_counts):
+    """Apply the mode rules to (n, len(COLOR_NAMES)) window counts; returns a color code per row, NO_COLOR if unreliable"""
+    totals = color_counts.sum(axis=1)
+    best = color_counts.argmax(axis=1)
+    best_counts = color_counts[np.arange(len(best)), best]
+
+    # At least MODE_MIN_SAMPLES recent samples, and MODE_CONFIDENCE of them must agree
+    reliable = (totals >= MODE_MIN_SAMPLES) & (best_counts >= totals * MODE_CONFIDENCE) & (best_counts > 0)
+    return np.where(reliable, best, NO_COLOR)
+
+class LEDSnapshot(NamedTuple):
+    """Status of every LED at one moment; published whole and never modified afterwards"""
+    generation: int  # Changes only when the per-LED values below change
+    timestamp: float
+    colors: Dict[str, Optional[str]]  # Mode color, None without enough agreeing recent samples
+    sample_counts: Dict[str, int]  # Samples held in the history
+    confidences: Dict[str, float]  # Share of recent samples that show the most frequent color
+    group_summaries: Dict[str, Dict[str, int]]  # {group: {color: LEDs showing it, ..., "no_data": LEDs without a color}}
+    color_masks: Dict[str, int]  # Bitmask over positions in led_ids of the LEDs showing each color
+
+def window_cutoff(now):
+    """Oldest sample time that still counts: the mode window, but never before the armed session"""
+    session = armed_session
+    cutoff = now - MODE_WINDOW_SECONDS
+    return max(cutoff, session["armed_at"]) if session else cutoff
+
+def detect_board_transition(now):
+    """Restart the sample windows when most LEDs change color together (e.g. a new test step).
+
+    An LED has flipped when its last TRANSITION_STREAK or more samples all show a color other
+    than its current mode. If enough of them flip, each flipped LED keeps only its new streak
+    and every other LED only the samples since the earliest flip, so an LED that went dark
+    loses its old color too. Returns the number of flipped LEDs when a transition was found.
+    """
+    cutoff = window_cutoff(now)
+    modes = mode_color_codes(led_samples.window_color_counts(cutoff))
+    codes, lengths = led_samples.streaks(cutoff, now - VERDICT_MAX_AGE)
+    flipped = (modes != NO_COLOR) & (codes != NO_COLOR) & (codes != modes) & (lengths >= TRANSITION_STREAK)
+
+    flip_count = int(flipped.sum())
+    if flip_count < max(TRANSITION_MIN_LEDS, TRANSITION_FRACTION * np.count_nonzero(modes != NO_COLOR)):
+        return 0
+
+    led_samples.restart_windows(flipped, float(led_samples.streak_starts[flipped].min()))
+    return flip_count
+
+def build_led_snapshot():
+    """Compute an LEDSnapshot from the sample history"""
+    now = time.time()
+    color_counts = led_samples.window_color_counts(window_cutoff(now))
+    codes = mode_color_codes(color_counts)
+    totals = color_counts.sum(axis=1)
+    confidences = np.divide(color_counts.max(axis=1, initial=0), totals,
+                            out=np.zeros(len(totals)), where=totals > 0)
+
+    names = COLOR_NAMES + (None,)
+    group_summaries = {}
+    for group, positions in led_groups.items():
+        group_counts = np.bincount(codes[positions], minlength=NO_COLOR + 1).tolist()
+        group_summaries[group] = dict(zip(COLOR_NAMES, group_counts))
+        group_summaries[group]["no_data"] = group_counts[NO_COLOR]
+
+    return LEDSnapshot(
+        generation=0,
+        timestamp=now,
+        colors=dict(zip(led_ids, [names[code] for code in codes.tolist()])),
+        sample_counts=dict(zip(led_ids, led_samples.sample_counts().tolist())),
+        confidences=dict(zip(led_ids, np.round(confidences, 3).tolist())),
+        group_summaries=group_summaries,
+        color_masks={color: positions_to_mask(codes == code, len(codes)) for code, color in enumerate(COLOR_NAMES)}
+    )
+
+def led_state_entry(snapshot, led_id):
+    """What /ws/leds reports for one LED"""
+    return {
+        "color": snapshot.colors[led_id],
+        "detected": snapshot.sample_counts[led_id] > 0
     }
-    
-    for color in recent_samples:
-        if color in color_counts:
-            color_counts[color] += 1
-    
-    # Find the color with the highest count
-    most_frequent_color = max(color_counts, key=color_counts.get)
-    max_count = color_counts[most_frequent_color]
-    
-    # Require at least 60% confidence (majority of samples must agree)
-    confidence_threshold = len(recent_samples) * 0.6
-    
-    if max_count >= confidence_threshold and max_count > 0:
-        return most_frequent_color
-    else:
-        # If no color has sufficient confidence, LED detection is unreliable
-        return None
+
+def publish_led_snapshot():
+    """Replace the shared snapshot; called by the camera side after every processed frame"""
+    global led_snapshot, led_journal_floor
+    with snapshot_lock:
+        flip_count = detect_board_transition(time.time())
+        if flip_count:
+            print(f"Board color transition: {flip_count} LEDs changed color, sample windows restarted")
+        snapshot = build_led_snapshot()
+        previous = led_snapshot
+        # Keep the generation while nothing clients can see has changed, so repeat polls stay cacheable
+        if previous is not None and snapshot[2:] == previous[2:]:
+            snapshot = snapshot._replace(generation=previous.generation)
+        else:
+            snapshot = snapshot._replace(generation=next(snapshot_generations))
+
+        # Journal the LEDs whose mode color or detection state changed
+        if previous is None:
+            led_change_journal.clear()
+            led_journal_floor = snapshot.generation
+        elif snapshot.generation != previous.generation:
+            changes = {
+                led_id: led_state_entry(snapshot, led_id) for led_id in led_ids
+                if snapshot.colors[led_id] != previous.colors[led_id]
+                or (snapshot.sample_counts[led_id] > 0) != (previous.sample_counts[led_id] > 0)
+            }
+            if changes:
+                if len(led_change_journal) == led_change_journal.maxlen:
+                    led_journal_floor = led_change_journal[0][0]
+                led_change_journal.append((snapshot.generation, changes))
+        led_snapshot = snapshot
+    return snapshot
+
+def get_led_changes(since):
+    """Merged changes of all generations after since, or None if the journal no longer reaches back that far"""
+    with snapshot_lock:
+        if since < led_journal_floor:
+            return None
+        entries = [changes for generation, changes in led_change_journal if generation > since]
+    merged = {}
+    for changes in entries:
+        merged.update(changes)
+    return merged
+
+def get_led_snapshot():
+    """The latest snapshot, rebuilt here if the camera side has stopped publishing"""
+    snapshot = led_snapshot
+    if snapshot is None or time.time() - snapshot.timestamp > SNAPSHOT_MAX_AGE:
+        snapshot = publish_led_snapshot()
+    return snapshot
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global camera_thread
+    global camera_thread, encode_executor
     load_config()
+    encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="jpeg")
     
-    # Start camera worker in a separate thread
-    camera_thread = threading.Thread(target=camera_worker, daemon=True)
+    # Start camera worker (or the per-camera process supervisor) in a separate thread
+    worker = camera_process_supervisor if use_camera_processes else camera_worker
+    camera_thread = threading.Thread(target=worker, daemon=True)
     camera_thread.start()
+
+    # The live window is refreshed by its own thread so detection never waits on the GUI
+    global preview_thread
+    if not headless:
+        preview_thread = threading.Thread(target=preview_worker, daemon=True)
+        preview_thread.start()
     print("LED Detection Server started")
     
     yield
@@ -421,6 +1648,10 @@ async def lifespan(app: FastAPI):
     camera_running = False
     if camera_thread:
         camera_thread.join(timeout=5)
+    if preview_thread:
+        preview_thread.join(timeout=5)
+    encode_executor.shutdown(wait=False, cancel_futures=True)
+    jpeg_cache.clear()
     print("LED Detection Server stopped")
 
 app = FastAPI(title="LED Detection Server", version="1.0.0", lifespan=lifespan)
@@ -429,48 +1660,120 @@ app = FastAPI(title="LED Detection Server", version="1.0.0", lifespan=lifespan)
 async def root():
     return {"message": "LED Detection Server is running", "version": "1.0.0"}
 
+def make_etag(kind, generation, weak=False):
+    return f'{"W/" if weak else ""}"{kind}-{generation}"'
+
+def is_not_modified(request: Request, etag, generation, since=None):
+    """True if the client already has this generation, via If-None-Match or ?since="""
+    if since is not None and generation <= since:
+        return True
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Weak comparison, as RFC 9110 asks for If-None-Match
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def not_modified_response(etag, generation):
+    return Response(status_code=304, headers={"ETag": etag, "X-Generation": str(generation)})
+
 @app.get("/status")
-async def get_status():
+async def get_status(request: Request, response: Response, since: Optional[int] = None):
+    global status_stamp
+    snapshot = get_led_snapshot()
+    cameras_connected = len([f for f in current_frames.values() if f is not None])
+
+    # The status changes with the LED snapshot or the camera state, so ?since= sees both
+    state = (snapshot.generation, camera_running, cameras_connected)
+    if status_stamp[0] != state:
+        status_stamp = (state, next(status_generations))
+    generation = status_stamp[1]
+
+    # Weak: the camera rates keep moving, but they alone don't make the status different
+    etag = make_etag("status", generation, weak=True)
+    if is_not_modified(request, etag, generation, since):
+        return not_modified_response(etag, generation)
+    response.headers["ETag"] = etag
+    response.headers["X-Generation"] = str(generation)
+
     return {
         "camera_running": camera_running,
-        "cameras_connected": len([f for f in current_frames.values() if f is not None]),
+        "cameras_connected": cameras_connected,
         "total_leds_configured": len(config_data),
-        "leds_with_samples": len(led_color_samples)
+        "leds_with_samples": sum(1 for sample_count in snapshot.sample_counts.values() if sample_count > 0),
+        "camera_fps": camera_frame_rates,
+        "generation": generation
     }
 
+def encode_view_jpeg(view, scale, quality):
+    """Render a frame view's overlays and encode it; runs in encode_executor"""
+    image = render_view(view)
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+async def get_view_jpeg(view, scale=1.0, quality=JPEG_QUALITY):
+    """JPEG bytes of a frame view, encoded at most once per (generation, scale, quality).
+
+    Concurrent requests for the same variant share one pending encode.
+    """
+    key = (view["generation"], scale, quality)
+    future = jpeg_cache.get(key)
+    if future is None:
+        future = encode_executor.submit(encode_view_jpeg, view, scale, quality)
+        jpeg_cache[key] = future
+        while len(jpeg_cache) > JPEG_CACHE_SIZE:
+            jpeg_cache.popitem(last=False)
+    else:
+        jpeg_cache.move_to_end(key)
+
+    try:
+        return await asyncio.wrap_future(future)
+    except Exception as e:
+        jpeg_cache.pop(key, None)
+        raise HTTPException(status_code=500, detail=f"Image encoding failed: {e}")
+
+async def view_image_response(request, view, filename, since=None, scale=1.0, quality=JPEG_QUALITY, headers=None):
+    """JPEG response for a frame view, or 304 if the client already has this generation"""
+    generation = view["generation"]
+    etag = make_etag(f"frame-{scale:g}x{quality}", generation)
+    if is_not_modified(request, etag, generation, since):
+        return not_modified_response(etag, generation)
+
+    jpeg = await get_view_jpeg(view, scale, quality)
+    return Response(
+        content=jpeg,
+        media_type="image/jpeg",
+        headers={
+            "Content-Disposition": f"inline; filename={filename}",
+            "ETag": etag,
+            "X-Generation": str(generation),
+            **(headers or {})
+        }
+    )
+
 @app.get("/combined_image")
-async def get_combined_image():
+async def get_combined_image(request: Request, since: Optional[int] = None,
+                             scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
     """Get the current combined camera image"""
-    global combined_frame
+    view = combined_frame
     
-    if combined_frame is None:
+    if view is None:
         raise HTTPException(status_code=404, detail="No combined image available")
     
-    # Convert frame to JPEG
-    _, buffer = cv2.imencode('.jpg', combined_frame)
-    
-    return StreamingResponse(
-        io.BytesIO(buffer.tobytes()),
-        media_type="image/jpeg",
-        headers={"Content-Disposition": "inline; filename=combined_image.jpg"}
-    )
+    return await view_image_response(request, view, "combined_image.jpg", since, scale, quality)
 
 @app.get("/best_image")
-async def get_best_image():
+async def get_best_image(request: Request, since: Optional[int] = None,
+                         scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
     """Get the image with maximum LEDs detected in last 3 seconds"""
-    global best_image_data
+    view = best_image_data["view"]
     
-    if best_image_data["image"] is None:
+    if view is None:
         raise HTTPException(status_code=404, detail="No best image available")
     
-    # Convert frame to JPEG
-    _, buffer = cv2.imencode('.jpg', best_image_data["image"])
-    
-    return StreamingResponse(
-        io.BytesIO(buffer.tobytes()),
-        media_type="image/jpeg",
-        headers={"Content-Disposition": "inline; filename=best_image.jpg"}
-    )
+    return await view_image_response(request, view, "best_image.jpg", since, scale, quality)
 
 @app.get("/best_image_info")
 async def get_best_image_info():
@@ -489,7 +1792,8 @@ async def get_best_image_info():
     }
 
 @app.get("/optimal_frame")
-async def get_optimal_frame():
+async def get_optimal_frame(request: Request, since: Optional[int] = None,
+                            scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
     """Get the optimal frame from recent captures using multi-frame analysis"""
     global best_image_data
     
@@ -510,19 +1814,11 @@ async def get_optimal_frame():
     # Find frame with highest quality score
     optimal_frame = max(recent_frames, key=lambda x: x["quality_score"])
     
-    # Convert frame to JPEG
-    _, buffer = cv2.imencode('.jpg', optimal_frame["image"])
-    
-    return StreamingResponse(
-        io.BytesIO(buffer.tobytes()),
-        media_type="image/jpeg",
-        headers={
-            "Content-Disposition": "inline; filename=optimal_frame.jpg",
-            "X-LED-Count": str(optimal_frame["led_count"]),
-            "X-Quality-Score": str(round(optimal_frame["quality_score"], 2)),
-            "X-Frame-Age": str(round(current_time - optimal_frame["timestamp"], 2))
-        }
-    )
+    return await view_image_response(request, optimal_frame["view"], "optimal_frame.jpg", since, scale, quality, headers={
+        "X-LED-Count": str(optimal_frame["led_count"]),
+        "X-Quality-Score": str(round(optimal_frame["quality_score"], 2)),
+        "X-Frame-Age": str(round(current_time - optimal_frame["timestamp"], 2))
+    })
 
 @app.get("/optimal_frame_info")
 async def get_optimal_frame_info():
@@ -568,57 +1864,146 @@ async def get_optimal_frame_info():
     }
 
 @app.get("/combined_image_base64")
-async def get_combined_image_base64():
+async def get_combined_image_base64(scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
     """Get the current combined camera image as base64"""
-    global combined_frame
+    view = combined_frame
     
-    if combined_frame is None:
+    if view is None:
         raise HTTPException(status_code=404, detail="No combined image available")
     
-    # Convert frame to JPEG and then to base64
-    _, buffer = cv2.imencode('.jpg', combined_frame)
-    img_base64 = base64.b64encode(buffer).decode('utf-8')
+    # Convert frame to JPEG (shared with /combined_image) and then to base64
+    jpeg = await get_view_jpeg(view, scale, quality)
+    img_base64 = base64.b64encode(jpeg).decode('utf-8')
     
     return {"image": img_base64, "format": "jpeg"}
 
 @app.get("/camera/{camera_name}")
-async def get_camera_image(camera_name: str):
+async def get_camera_image(camera_name: str, request: Request, since: Optional[int] = None,
+                           scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
     """Get image from a specific camera"""
     if camera_name not in current_frames:
         raise HTTPException(status_code=404, detail=f"Camera {camera_name} not found")
     
-    frame = current_frames[camera_name]
-    if frame is None:
+    view = current_frames[camera_name]
+    if view is None:
         raise HTTPException(status_code=404, detail=f"No image available from {camera_name}")
     
-    # Convert frame to JPEG
-    _, buffer = cv2.imencode('.jpg', frame)
-    
+    return await view_image_response(request, view, f"{camera_name.replace(' ', '_')}.jpg", since, scale, quality)
+
+async def mjpeg_stream(get_view, fps, scale, quality):
+    """multipart/x-mixed-replace body that sends the newest frame view at most fps times a second.
+
+    Each part is taken from whatever view is current when the client is ready for it, so a
+    slow client skips frames instead of queueing them, and viewers share the encode cache.
+    """
+    interval = 1.0 / fps
+    last_generation = None
+    while camera_running:
+        started = time.monotonic()
+        view = get_view()
+        if view is not None and view["generation"] != last_generation:
+            last_generation = view["generation"]
+            jpeg = await get_view_jpeg(view, scale, quality)
+            yield (f"--{MJPEG_BOUNDARY}\r\n"
+                   f"Content-Type: image/jpeg\r\n"
+                   f"Content-Length: {len(jpeg)}\r\n"
+                   f"X-Generation: {last_generation}\r\n\r\n").encode() + jpeg + b"\r\n"
+        await asyncio.sleep(max(interval - (time.monotonic() - started), 0.005))
+
+def mjpeg_response(get_view, fps, scale, quality):
+    # The stream ends when the cameras stop, so refuse it up front rather than send an empty body
+    if not camera_running:
+        raise HTTPException(status_code=503, detail="Cameras are not running")
     return StreamingResponse(
-        io.BytesIO(buffer.tobytes()),
-        media_type="image/jpeg",
-        headers={"Content-Disposition": f"inline; filename={camera_name.replace(' ', '_')}.jpg"}
+        mjpeg_stream(get_view, fps, scale, quality),
+        media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+        headers={"Cache-Control": "no-cache"}
     )
 
+@app.get("/stream/combined")
+async def stream_combined(fps: float = Query(MJPEG_FPS, gt=0, le=MJPEG_MAX_FPS),
+                          scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
+    """Live MJPEG stream of the combined camera image"""
+    return mjpeg_response(lambda: combined_frame, fps, scale, quality)
+
+@app.get("/stream/camera/{camera_name}")
+async def stream_camera(camera_name: str, fps: float = Query(MJPEG_FPS, gt=0, le=MJPEG_MAX_FPS),
+                        scale: float = Query(1.0, gt=0, le=1), quality: int = Query(JPEG_QUALITY, ge=1, le=100)):
+    """Live MJPEG stream of a specific camera"""
+    if camera_name not in current_frames:
+        raise HTTPException(status_code=404, detail=f"Camera {camera_name} not found")
+    return mjpeg_response(lambda: current_frames[camera_name], fps, scale, quality)
+
+@app.websocket("/ws/leds")
+async def leds_websocket(websocket: WebSocket, since: Optional[str] = None):
+    """Push LED states: a full snapshot first, then only the LEDs whose color or detection changed.
+
+    Messages are {"type": "snapshot" | "changes", "instance": i, "generation": g, "leds": {led_id: state}}.
+    A client that reconnects with ?since=<instance>:<last generation it saw> gets just the
+    changes it missed, or a new full snapshot if they are no longer in the journal or the
+    server has restarted since (the instance differs).
+    """
+    await websocket.accept()
+
+    sent = None
+    instance, _, generation = (since or "").partition(":")
+    if instance == server_instance and generation.isdigit():
+        sent = int(generation)
+
+    # Nothing is expected from the client; this only notices when it goes away
+    async def wait_for_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    disconnected = asyncio.create_task(wait_for_disconnect())
+
+    try:
+        while not disconnected.done():
+            snapshot = get_led_snapshot()
+            if sent is None or snapshot.generation != sent:
+                changes = None
+                if sent is not None and sent <= snapshot.generation:
+                    changes = get_led_changes(sent)
+
+                if changes is None:
+                    await websocket.send_json({
+                        "type": "snapshot",
+                        "instance": server_instance,
+                        "generation": snapshot.generation,
+                        "leds": {led_id: led_state_entry(snapshot, led_id) for led_id in led_ids}
+                    })
+                elif changes:
+                    await websocket.send_json({
+                        "type": "changes",
+                        "instance": server_instance,
+                        "generation": snapshot.generation,
+                        "leds": changes
+                    })
+                sent = snapshot.generation
+
+            await asyncio.sleep(WS_POLL_INTERVAL)
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Client went away while we were sending
+    finally:
+        disconnected.cancel()
+
 @app.get("/led_status")
 async def get_all_led_status():
     """Get the current status of all LEDs based on mode of last 30 samples"""
+    snapshot = get_led_snapshot()
     led_status = {}
     
-    for led_id in config_data.keys():
-        color = get_led_mode_color(led_id)
-        sample_count = len(led_color_samples[led_id]) if led_id in led_color_samples else 0
-        
+    for led_id, color in snapshot.colors.items():
         led_status[led_id] = {
             "color": color,
-            "sample_count": sample_count,
+            "sample_count": snapshot.sample_counts[led_id],
+            "confidence": snapshot.confidences[led_id],
             "coordinates": config_data[led_id]
         }
     
     return {
         "led_status": led_status,
         "total_leds": len(config_data),
-        "timestamp": time.time()
+        "timestamp": snapshot.timestamp
     }
 
 @app.get("/led_status/{led_id}")
@@ -627,38 +2012,113 @@ async def get_led_status(led_id: str):
     if led_id not in config_data:
         raise HTTPException(status_code=404, detail=f"LED {led_id} not found in configuration")
     
-    color = get_led_mode_color(led_id)
-    sample_count = len(led_color_samples[led_id]) if led_id in led_color_samples else 0
+    snapshot = get_led_snapshot()
+    recent_samples = [COLOR_NAMES[code] for code in led_samples.recent(led_id_table[led_id]).tolist()]
     
     return {
         "led_id": led_id,
-        "color": color,
-        "sample_count": sample_count,
+        "color": snapshot.colors[led_id],
+        "sample_count": snapshot.sample_counts[led_id],
+        "confidence": snapshot.confidences[led_id],
         "coordinates": config_data[led_id],
-        "recent_samples": [s["color"] if isinstance(s, dict) else s for s in led_color_samples[led_id]] if led_id in led_color_samples else [],
-        "timestamp": time.time()
+        "recent_samples": recent_samples,
+        "timestamp": snapshot.timestamp
     }
 
 @app.get("/led_colors")
-async def get_led_colors():
+async def get_led_colors(request: Request, response: Response, since: Optional[int] = None):
     """Get only the LED IDs and their current colors (mode of 30 samples)"""
-    led_colors = {}
+    snapshot = get_led_snapshot()
+
+    etag = make_etag("leds", snapshot.generation)
+    if is_not_modified(request, etag, snapshot.generation, since):
+        return not_modified_response(etag, snapshot.generation)
+    response.headers["ETag"] = etag
+    response.headers["X-Generation"] = str(snapshot.generation)
     
-    for led_id in config_data.keys():
-        color = get_led_mode_color(led_id)
-        if color:  # Only include LEDs that have color data
-            led_colors[led_id] = color
+    # Only include LEDs that have color data
+    led_colors = {led_id: color for led_id, color in snapshot.colors.items() if color}
     
     return {
         "led_colors": led_colors,
-        "timestamp": time.time()
+        "generation": snapshot.generation,
+        "timestamp": snapshot.timestamp
     }
 
+@app.get("/leds")
+async def query_leds(request: Request, ids: Optional[str] = None, group: Optional[str] = None, fields: str = "color"):
+    """Several LEDs in one request, with only the fields asked for.
+
+    ids is a comma-separated list of LED IDs, otherwise the LEDs of group (default all);
+    fields is a comma-separated subset of LED_QUERY_FIELDS. The answer is columnar,
+    {"ids": [...], "<field>": [...], ...}, as JSON or, by Accept header, as msgpack
+    (application/msgpack) or as packed little-endian records (application/octet-stream)
+    whose layout is given in the X-Record-Format header.
+    """
+    field_names = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in field_names if field not in LED_QUERY_FIELDS]
+    if unknown or not field_names:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, expected some of {', '.join(LED_QUERY_FIELDS)}")
+
+    if ids:
+        selected = [led_id.strip() for led_id in ids.split(",") if led_id.strip()]
+        missing = [led_id for led_id in selected if led_id not in led_id_table]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"LEDs {', '.join(missing)} not found in configuration")
+        positions = np.array([led_id_table[led_id] for led_id in selected], dtype=np.int64)
+    else:
+        group = group or "all"
+        if group not in led_groups:
+            raise HTTPException(status_code=404, detail=f"LED group {group} not found")
+        positions = led_groups[group]
+        selected = [led_ids[position] for position in positions.tolist()]
+
+    snapshot = get_led_snapshot()
+    records = np.zeros(len(selected), dtype=[(field, LED_QUERY_FIELDS[field]) for field in field_names])
+    if "color" in field_names:
+        records["color"] = [COLOR_CODES.get(snapshot.colors[led_id], NO_COLOR) for led_id in selected]
+    if "count" in field_names:
+        records["count"] = [snapshot.sample_counts[led_id] for led_id in selected]
+    if "confidence" in field_names:
+        records["confidence"] = [snapshot.confidences[led_id] for led_id in selected]
+    if "last_seen" in field_names:
+        last_seen = led_samples.last_seen()[positions]
+        records["last_seen"] = np.where(np.isfinite(last_seen), last_seen, np.nan)
+
+    accept = request.headers.get("accept", "")
+    if "application/octet-stream" in accept:
+        return Response(
+            content=records.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Record-Format": ",".join(f"{field}:{LED_QUERY_FIELDS[field]}" for field in field_names),
+                "X-LED-Ids": ",".join(selected),
+                "X-Color-Names": ",".join(COLOR_NAMES),
+                "X-Generation": str(snapshot.generation)
+            }
+        )
+
+    columns = {"generation": snapshot.generation, "timestamp": snapshot.timestamp, "ids": selected}
+    for field in field_names:
+        if field == "color":
+            columns[field] = [snapshot.colors[led_id] for led_id in selected]
+        elif field == "confidence":
+            columns[field] = [snapshot.confidences[led_id] for led_id in selected]
+        else:
+            values = records[field].tolist()
+            columns[field] = [None if value != value else value for value in values]  # NaN -> None
+
+    if "msgpack" in accept:
+        if msgpack is None:
+            raise HTTPException(status_code=406, detail="msgpack is not installed on the server")
+        return Response(content=msgpack.packb(columns), media_type="application/msgpack")
+    return columns
+
 @app.post("/clear_samples")
 async def clear_led_samples():
     """Clear all LED color samples"""
-    global led_color_samples
-    led_color_samples.clear()
+    led_samples.clear()
+    publish_led_snapshot()
     return {"message": "All LED samples cleared"}
 
 @app.post("/clear_samples/{led_id}")
@@ -667,113 +2127,235 @@ async def clear_led_samples_for_id(led_id: str):
     if led_id not in config_data:
         raise HTTPException(status_code=404, detail=f"LED {led_id} not found in configuration")
     
-    if led_id in led_color_samples:
-        led_color_samples[led_id].clear()
+    led_samples.clear(led_id_table[led_id])
+    publish_led_snapshot()
     
     return {"message": f"Samples cleared for LED {led_id}"}
 
+def check_group_colors(snapshot, group):
+    """One pass over a group's LEDs sorting them for a check of every color at once.
+
+    Returns (group LED IDs, {color: (matching LEDs, [{"led_id", "color"} of the others])},
+    LEDs without data). Results are cached until the snapshot generation changes.
+    """
+    cached = group_checks.get(group)
+    if cached is not None and cached[0] == snapshot.generation:
+        return cached[1]
+
+    leds = group_led_ids(group)
+    by_color = {color: ([], []) for color in COLOR_NAMES}
+    no_data = []
+    for led_id in leds:
+        led_color = snapshot.colors[led_id]
+        if led_color is None:
+            no_data.append(led_id)
+            continue
+        entry = {"led_id": led_id, "color": led_color}
+        for color, (matching, non_matching) in by_color.items():
+            if color == led_color:
+                matching.append(led_id)
+            else:
+                non_matching.append(entry)
+
+    result = (leds, by_color, no_data)
+    group_checks[group] = (snapshot.generation, result)
+    return result
+
+def check_payload(color, group, leds, matching, non_matching, no_data, timestamp):
+    """Response of a colour check in the /check_*_leds shape; other groups than "all" name themselves in the keys"""
+    prefix = "" if group == "all" else f"{group}_"
+    payload = {
+        f"all_{prefix}leds_{color}": len(non_matching) == 0 and len(no_data) == 0,
+        f"total_{prefix}leds": len(leds),
+        f"{color}_leds_count": len(matching),
+        f"non_{color}_leds": non_matching,
+        "no_data_leds": no_data
+    }
+    if group != "all":
+        payload[f"{group}_leds_checked"] = leds
+    payload["timestamp"] = timestamp
+    return payload
+
+def group_check_payload(snapshot, color, group):
+    leds, by_color, no_data = check_group_colors(snapshot, group)
+    matching, non_matching = by_color[color]
+    return check_payload(color, group, leds, matching, non_matching, no_data, snapshot.timestamp)
+
+def group_led_ids(group):
+    return [led_ids[position] for position in led_groups[group].tolist()]
+
+@app.get("/groups")
+async def get_led_groups():
+    """The configured LED groups and their members"""
+    return {"groups": {group: group_led_ids(group) for group in led_groups}}
+
+@app.get("/check")
+async def check_leds(color: str, group: str = "all"):
+    """Check if every LED of a group shows color, if not list which don't"""
+    validate_color_group(color, group)
+    snapshot = get_led_snapshot()
+    payload = group_check_payload(snapshot, color, group)
+    payload.update({"color": color, "group": group, "generation": snapshot.generation})
+    return payload
+
 @app.get("/check_red_leds")
 async def check_red_leds():
     """Check if all 69 LEDs are red, if not list which are not red"""
-    all_leds = list(config_data.keys())
-    non_red_leds = []
-    red_leds = []
-    no_data_leds = []
-    
-    for led_id in all_leds:
-        color = get_led_mode_color(led_id)
-        if color is None:
-            no_data_leds.append(led_id)
-        elif color != 'red':
-            non_red_leds.append({"led_id": led_id, "color": color})
-        else:
-            red_leds.append(led_id)
-    
-    all_red = len(non_red_leds) == 0 and len(no_data_leds) == 0
-    
-    return {
-        "all_leds_red": all_red,
-        "total_leds": len(all_leds),
-        "red_leds_count": len(red_leds),
-        "non_red_leds": non_red_leds,
-        "no_data_leds": no_data_leds,
-        "timestamp": time.time()
-    }
+    return group_check_payload(get_led_snapshot(), 'red', "all")
 
 @app.get("/check_green_leds")
 async def check_green_leds():
     """Check if all 69 LEDs are green, if not list which are not green"""
-    all_leds = list(config_data.keys())
-    non_green_leds = []
-    green_leds = []
-    no_data_leds = []
-    
-    for led_id in all_leds:
-        color = get_led_mode_color(led_id)
-        if color is None:
-            no_data_leds.append(led_id)
-        elif color != 'green':
-            non_green_leds.append({"led_id": led_id, "color": color})
-        else:
-            green_leds.append(led_id)
-    
-    all_green = len(non_green_leds) == 0 and len(no_data_leds) == 0
-    
-    return {
-        "all_leds_green": all_green,
-        "total_leds": len(all_leds),
-        "green_leds_count": len(green_leds),
-        "non_green_leds": non_green_leds,
-        "no_data_leds": no_data_leds,
-        "timestamp": time.time()
-    }
+    return group_check_payload(get_led_snapshot(), 'green', "all")
 
 @app.get("/check_blue_leds")
 async def check_blue_leds():
     """Check if all 18 eth-type LEDs are blue, if not list which are not blue"""
-    # Get only eth-type LEDs (eth1-1, eth1-2, eth5, eth6, etc.)
-    eth_leds = [led_id for led_id in config_data.keys() if led_id.startswith('eth')]
-    
-    non_blue_leds = []
-    blue_leds = []
-    no_data_leds = []
-    
-    for led_id in eth_leds:
-        color = get_led_mode_color(led_id)
-        if color is None:
-            no_data_leds.append(led_id)
-        elif color != 'blue':
-            non_blue_leds.append({"led_id": led_id, "color": color})
-        else:
-            blue_leds.append(led_id)
-    
-    all_blue = len(non_blue_leds) == 0 and len(no_data_leds) == 0
-    
+    # Only eth-type LEDs (eth1-1, eth1-2, eth5, eth6, etc.)
+    return group_check_payload(get_led_snapshot(), 'blue', "eth")
+
+def validate_color_group(color, group):
+    if color not in COLOR_CODES:
+        raise HTTPException(status_code=400, detail=f"Unknown color {color}, expected one of {', '.join(COLOR_NAMES)}")
+    if group not in led_groups:
+        raise HTTPException(status_code=404, detail=f"LED group {group} not found")
+
+@app.get("/patterns")
+async def get_led_patterns():
+    """The expected LED states of every test step"""
+    return {"patterns": {
+        step: {
+            "colors": {color: [led_ids[position] for position in mask_to_positions(mask)]
+                       for color, mask in pattern.color_masks.items() if mask},
+            "off": [led_ids[position] for position in mask_to_positions(pattern.off_mask)]
+        }
+        for step, pattern in led_patterns.items()
+    }}
+
+@app.get("/verdict/{step}")
+async def get_step_verdict(step: str):
+    """Check the current LED states against a test step's expected pattern"""
+    pattern = led_patterns.get(step)
+    if pattern is None:
+        raise HTTPException(status_code=404, detail=f"LED pattern {step} not found")
+
+    snapshot = get_led_snapshot()
+    lit_mask = 0
+    for mask in snapshot.color_masks.values():
+        lit_mask |= mask
+
+    # Expected LEDs not showing their color, and LEDs that should be off but show one
+    wrong_color_mask = 0
+    expected_mask = pattern.off_mask
+    for color, mask in pattern.color_masks.items():
+        wrong_color_mask |= mask & ~snapshot.color_masks[color]
+        expected_mask |= mask
+    lit_off_mask = pattern.off_mask & lit_mask
+
+    mismatches = []
+    for position in mask_to_positions(wrong_color_mask | lit_off_mask):
+        led_id = led_ids[position]
+        expected = next((color for color, mask in pattern.color_masks.items() if mask >> position & 1), "off")
+        mismatches.append({"led_id": led_id, "expected": expected, "actual": snapshot.colors[led_id]})
+
+    checked = bin(expected_mask).count("1")
     return {
-        "all_eth_leds_blue": all_blue,
-        "total_eth_leds": len(eth_leds),
-        "blue_leds_count": len(blue_leds),
-        "non_blue_leds": non_blue_leds,
-        "no_data_leds": no_data_leds,
-        "eth_leds_checked": eth_leds,
-        "timestamp": time.time()
+        "step": step,
+        "passed": not mismatches,
+        "checked_leds": checked,
+        "matching_leds": checked - len(mismatches),
+        "mismatches": mismatches,
+        "generation": snapshot.generation,
+        "timestamp": snapshot.timestamp
     }
 
+@app.post("/arm")
+async def arm(color: str, group: str = "all"):
+    """Open a new sample window: from now on modes, checks and verdicts only count samples taken after arming"""
+    global armed_session
+    validate_color_group(color, group)
+
+    armed_session = {
+        "session_id": next(arm_sessions),
+        "color": color,
+        "group": group,
+        "armed_at": time.time()
+    }
+    publish_led_snapshot()
+    return {**armed_session, "total_leds": len(led_groups[group])}
+
+@app.get("/arm")
+async def get_armed_session():
+    """The current armed session, if any"""
+    if armed_session is None:
+        return {"armed": False}
+    return {"armed": True, **armed_session, "age_seconds": round(time.time() - armed_session["armed_at"], 3)}
+
+@app.get("/await_verdict")
+async def await_verdict(color: Optional[str] = None, group: Optional[str] = None,
+                        timeout: float = Query(10.0, ge=0, le=VERDICT_MAX_TIMEOUT),
+                        streak: int = Query(VERDICT_STREAK, ge=1, le=SAMPLE_HISTORY),
+                        session: Optional[int] = None):
+    """Wait until every LED of the group has shown color for streak samples in a row, or until timeout.
+
+    Answers in the /check_*_leds shape as soon as the group is confirmed, so callers don't
+    have to wait for the mode window to flush. LEDs still short of the streak are listed
+    as no data; LEDs whose current streak is another color are listed with that color.
+    Only samples of the armed window count; color and group default to the armed ones,
+    and a session id that is no longer current is rejected.
+    """
+    armed = armed_session
+    if session is not None and (armed is None or armed["session_id"] != session):
+        raise HTTPException(status_code=409, detail=f"Session {session} is not the armed session")
+    if armed is not None:
+        color = color or armed["color"]
+        group = group or armed["group"]
+    if color is None:
+        raise HTTPException(status_code=400, detail="No color given and no armed session")
+    group = group or "all"
+    validate_color_group(color, group)
+
+    positions = led_groups[group]
+    started = time.time()
+    while True:
+        now = time.time()
+        codes, lengths = led_samples.streaks(window_cutoff(now), now - VERDICT_MAX_AGE)
+        codes, lengths = codes[positions], lengths[positions]
+        confirmed = (codes == COLOR_CODES[color]) & (lengths >= streak)
+        if confirmed.all() or time.time() - started >= timeout:
+            break
+        await asyncio.sleep(VERDICT_POLL_INTERVAL)
+
+    leds = group_led_ids(group)
+    matching, non_matching, no_data = [], [], []
+    for led_id, code, is_confirmed in zip(leds, codes.tolist(), confirmed.tolist()):
+        if is_confirmed:
+            matching.append(led_id)
+        elif code != NO_COLOR and code != COLOR_CODES[color]:
+            non_matching.append({"led_id": led_id, "color": COLOR_NAMES[code]})
+        else:
+            no_data.append(led_id)
+
+    payload = check_payload(color, group, leds, matching, non_matching, no_data, time.time())
+    payload["waited_seconds"] = round(payload["timestamp"] - started, 3)
+    payload["session_id"] = armed["session_id"] if armed else None
+    return payload
+
 @app.get("/check_undetected_leds")
 async def check_undetected_leds():
     """Check which LEDs from configuration are not being detected at all"""
-    all_configured_leds = set(config_data.keys())
-    detected_leds = set(led_color_samples.keys())
+    snapshot = get_led_snapshot()
     
     # LEDs with no samples at all
-    never_detected = list(all_configured_leds - detected_leds)
+    never_detected = [led_id for led_id, sample_count in snapshot.sample_counts.items() if sample_count == 0]
     
     # LEDs with samples but very few (less than 5 samples)
     poorly_detected = []
     well_detected = []
     
-    for led_id in detected_leds:
-        sample_count = len(led_color_samples[led_id])
+    for led_id, sample_count in snapshot.sample_counts.items():
+        if sample_count == 0:
+            continue
         if sample_count < 5:
             poorly_detected.append({"led_id": led_id, "sample_count": sample_count})
         else:
@@ -783,57 +2365,79 @@ async def check_undetected_leds():
     
     return {
         "all_leds_detected_well": total_issues == 0,
-        "total_configured_leds": len(all_configured_leds),
+        "total_configured_leds": len(led_ids),
         "well_detected_count": len(well_detected),
         "never_detected": never_detected,
         "never_detected_count": len(never_detected),
         "poorly_detected": poorly_detected,
         "poorly_detected_count": len(poorly_detected),
-        "detection_rate": len(well_detected) / len(all_configured_leds) * 100,
-        "timestamp": time.time()
+        "detection_rate": len(well_detected) / max(len(led_ids), 1) * 100,
+        "timestamp": snapshot.timestamp
     }
 
 @app.get("/debug_colors")
 async def debug_colors():
     """Debug endpoint to see current color distribution"""
-    color_summary = {"red": 0, "green": 0, "blue": 0, "orange": 0}
-    led_details = {}
-    
-    for led_id in config_data.keys():
-        if led_id in led_color_samples and len(led_color_samples[led_id]) > 0:
-            samples = list(led_color_samples[led_id])
-            # Extract colors from samples (handle both old and new format)
-            recent_colors = []
-            for sample in samples[-5:]:  # Last 5 samples
-                if isinstance(sample, dict):
-                    recent_colors.append(sample["color"])
-                else:
-                    recent_colors.append(sample)
-            
-            current_color = get_led_mode_color(led_id)
-            
-            led_details[led_id] = {
-                "current_color": current_color,
-                "recent_samples": recent_colors,
-                "total_samples": len(samples)
-            }
-            
-            if current_color and current_color in color_summary:
-                color_summary[current_color] += 1
-    
-    # ETH LED specific info
-    eth_details = {k: v for k, v in led_details.items() if k.startswith('eth')}
+    snapshot = get_led_snapshot()
+    color_summary = {color: snapshot.group_summaries["all"][color] for color in COLOR_NAMES}
+    detected = [led_id for led_id, sample_count in snapshot.sample_counts.items() if sample_count > 0]
+    eth_leds = group_led_ids("eth")
+    
+    # Details (with the last 5 samples) for the first 10 detected LEDs
+    sample_led_details = {}
+    for led_id in detected[:10]:
+        sample_led_details[led_id] = {
+            "current_color": snapshot.colors[led_id],
+            "recent_samples": [COLOR_NAMES[code] for code in led_samples.recent(led_id_table[led_id], 5).tolist()],
+            "total_samples": snapshot.sample_counts[led_id]
+        }
     
     return {
         "color_summary": color_summary,
-        "total_detected": len(led_details),
-        "eth_leds_total": len([k for k in config_data.keys() if k.startswith('eth')]),
-        "eth_leds_detected": len(eth_details),
-        "eth_blue_count": sum(1 for details in eth_details.values() if details["current_color"] == "blue"),
-        "sample_led_details": {k: v for k, v in list(led_details.items())[:10]},
-        "timestamp": time.time()
+        "total_detected": len(detected),
+        "eth_leds_total": len(eth_leds),
+        "eth_leds_detected": sum(1 for led_id in eth_leds if snapshot.sample_counts[led_id] > 0),
+        "eth_blue_count": snapshot.group_summaries["eth"]["blue"],
+        "sample_led_details": sample_led_details,
+        "timestamp": snapshot.timestamp
     }
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="LED Detection Server")
+    parser.add_argument("--engine", action="append", default=[], metavar="[CAMERA=]ENGINE",
+                        help="Detection engine (hough or stencil) for all cameras, or for one camera, "
+                             "e.g. --engine \"Camera 2=stencil\". May be repeated.")
+    parser.add_argument("--full-frame-hough", action="store_true",
+                        help="Run HoughCircles over the whole frame instead of only around configured LEDs")
+    parser.add_argument("--processes", action="store_true",
+                        help="Run capture and detection in one process per camera, sharing results through shared memory")
+    parser.add_argument("--headless", action="store_true",
+                        help="Do not open the live preview window (for station PCs without a display)")
+    parser.add_argument("--preview-fps", type=float, default=preview_fps,
+                        help=f"Refresh rate of the live preview window (default {preview_fps:g})")
+    args = parser.parse_args()
+
+    if args.preview_fps <= 0:
+        parser.error("--preview-fps must be positive")
+    headless = args.headless
+    preview_fps = args.preview_fps
+
+    use_camera_processes = args.processes
+
+    if args.full_frame_hough:
+        HOUGH_SEARCH_MARGIN = None
+
+    for option in args.engine:
+        camera, _, engine = option.rpartition("=")
+        cameras = [camera] if camera else list(STREAM_NAMES)
+        if engine not in DETECTION_ENGINES or any(name not in STREAM_NAMES for name in cameras):
+            parser.error(f"invalid --engine value: {option!r}")
+        for name in cameras:
+            detection_engines[name] = engine
+    print(f"Detection engines: {detection_engines}")
+
+    # Open /stream responses never finish on their own; don't let them hold up shutdown
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=MJPEG_SHUTDOWN_GRACE) 
\ No newline at end of file